@@ -3,24 +3,24 @@
 ## and saves them to a new CSV file
 ## The dataframes contain the correlation values for each pair of subjects.
 
-import pandas as pd
+import sys
 from pathlib import Path
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from movie_variability.pairs import PairIndex
+from movie_variability.store import MatrixStore
+
 # Define the range for nodes
 num_nodes = 210 # 210 cortical parcels of the Brainnetome atlas
 num_movies = 8 # 8 movies
 
-# Load the all pairs list
+# Load the pair index (integer subject codes and pair index arrays)
 data_dir = Path('/project/3011157.03/Simon/proj_2022_CABB_movie/MRI')
-all_pairs_list_path = data_dir / 'all_pair_list_with_reverse.csv'
-all_pairs_list = pd.read_csv(all_pairs_list_path)
-
-# remove "sub-" from the subject names
-all_pairs_list['Subject1'] = all_pairs_list['Subject1'].str.replace('sub-', '')
-all_pairs_list['Subject2'] = all_pairs_list['Subject2'].str.replace('sub-', '')
+pair_index = PairIndex.load(data_dir / 'pair_index.npz')
 
-# Define the directory where the similarity matrices are stored
+# Define the directory where the similarity matrices are stored (memory-mapped matrix store)
 matrix_dir = Path('/project/3011157.03/Simon/proj_2022_CABB_movie/Scripts/03_2ndLev_ISC/matrices')
+isc_store = MatrixStore(matrix_dir / 'ISC_matrices')
 
 # Directory to save the results
 output_dir = Path('/project/3011157.03/Simon/proj_2022_CABB_movie/Scripts/03_2ndLev_ISC/dataframes')
@@ -28,37 +28,23 @@ if not output_dir.exists():
     output_dir.mkdir(exist_ok=True)
     print(f'Created directory: {output_dir}')
 
+# Map the pairs to row and column indices of the matrices once
+rows, cols = pair_index.indices(isc_store.subjects, ordered=True)
+
 # Iterate over each movie and node
 for movie in range(1, num_movies + 1):
+    if f'movie{movie}' not in isc_store.coords['movie']:
+        print(f'Matrices not found: movie{movie}')
+        continue
+    # Gather the correlation values of all pairs from all parcels of this movie at once (parcels x pairs)
+    correlation_values = isc_store.get(movie=f'movie{movie}')[:, rows, cols]
     for node in range(1, num_nodes + 1):
-        # Form the file name according to the provided pattern
-        matrix_filename = matrix_dir / f'ISC_movie{movie}_parcel{node}.csv'
-        if matrix_filename.exists():
-            # Read the similarity matrix
-            similarity_matrix = pd.read_csv(matrix_filename, index_col=0)
-            # Convert index and columns to string with padding
-            similarity_matrix.index = similarity_matrix.index.map(lambda x: f'{x:03}')
-            similarity_matrix.columns = similarity_matrix.columns.map(lambda x: f'{int(x):03}')
-
-            # Initialize a list to hold the correlation data
-            correlation_data = []
-
-            # Loop through each pair
-            for _, row in all_pairs_list.iterrows():
-                subject1_padded = row["Subject1"]
-                subject2_padded = row["Subject2"]
-
-                # Extract the correlation value from the similarity matrix
-                correlation_value = similarity_matrix.loc[subject1_padded, subject2_padded]
-
-                # Append the pair type, subjects, and their correlation to the list
-                correlation_data.append([row['Pair_Type'], subject1_padded, subject2_padded, correlation_value])
-
-            # Convert the list to a DataFrame
-            correlation_df = pd.DataFrame(correlation_data, columns=['Pair_Type', 'Subject1', 'Subject2', 'Correlation'])
+        if node in isc_store.coords['parcel']:
+            # Create a DataFrame with the pair type, subjects, and their correlation
+            correlation_df = pair_index.table(correlation_values[isc_store.coords['parcel'].index(node)], 'Correlation', ordered=True)
 
             # Save the results to a new CSV file
             output_file_name = output_dir / f'ISCdf_full_movie{movie}_parcel{node}.csv'
             correlation_df.to_csv(output_file_name, index=False)
         else:
-            print(f'File not found: {matrix_filename}')
+            print(f'Matrix not found: movie{movie}, parcel{node}')
@@ -1,16 +1,21 @@
 #!/usr/bin/env python
 import os
+import sys
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
 
-from nltools.data import Brain_Data, Adjacency
-from nltools.mask import expand_mask, roi_to_brain
-from nltools.stats import threshold
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from movie_variability.atlas import Atlas
+from movie_variability.isc import standardize_timeseries, isc_from_standardized, update_isc, bootstrap_isc, chunked_isc, \
+    loo_isc, loo_inference
+from movie_variability.manifest import Manifest
+from movie_variability.pairs import PairIndex
+from movie_variability.render import render_glass_brains
+from movie_variability.store import MatrixStore, load_timeseries_cube
+from movie_variability.trace import Tracer
 
-from nilearn import plotting as nplot
-from sklearn.metrics import pairwise_distances
-from statsmodels.stats.multitest import fdrcorrection  # Import for FDR correction
+## timing and memory of every step are appended to pipeline_logs/trace/create_isc_matrices.jsonl
+tracer = Tracer('create_isc_matrices')
 
 ## location of main project directory on HPC
 projpath = '/project/3011157.03/Simon/proj_2022_CABB_movie/'
@@ -24,12 +29,11 @@ mask_path = os.path.join(projpath, 'MRI', 'groupmask_movies.nii.gz')
 ## get brain parcellation (k = 210 cortical parcels; "Brainnetome" atlas, Fan et al. 2016, Cerebral Cortex)
 mask_name = 'Brainnetome'
 brainnetome_path = os.path.join(projpath, 'MRI', 'Brainnetome_atlas', 'BN_Atlas_210_cortical_2mm.nii.gz')
-mask = Brain_Data(brainnetome_path, mask = mask_path)
-mask_x = expand_mask(mask)
+mask = Atlas.load(brainnetome_path, mask_path) # cached atlas restricted to the group mask
 atlas_labels = pd.read_csv(os.path.join(projpath, 'MRI', 'Brainnetome_atlas/Brainnetome_labels_cortical.csv'))
 
-## location of extracted movie fMRI time series
-mov_csv_path = os.path.join(fmriprep_dir, 'derivatives', 'secLev_nltools_ISC_ROI', mask_name, 'csv_files')
+## location of extracted movie fMRI time series (one subjects x TRs x parcels cube per movie)
+mov_cube_path = os.path.join(fmriprep_dir, 'derivatives', 'secLev_nltools_ISC_ROI', mask_name, 'cubes')
 
 ## where should the ISC matrices be stored?
 dir_out = os.path.join(projpath, 'Scripts', '03_2ndLev_ISC', 'matrices')
@@ -37,6 +41,46 @@ if not os.path.exists(os.path.join(dir_out)):
     os.makedirs(os.path.join(dir_out))
     print('Dir %s created ' % dir_out)
 
+## store all ISC matrices in one memory-mapped (movie x parcel x subject x subject) array
+movie_list = ['movie1', 'movie2', 'movie3', 'movie4', 'movie5', 'movie6', 'movie7', 'movie8']
+isc_store_path = os.path.join(dir_out, 'ISC_matrices')
+export_csv = False # set to true to additionally write one CSV file per movie and parcel
+## incremental mode: only compute the rows and columns of subjects that are new in the subjectlist
+## (uses the stored ISC matrices and standardized time series of the previous run)
+incremental = False # set to true after adding subjects to the subjectlist
+## movies whose timeseries cube and parameters are unchanged since the last run are skipped
+## (recorded in a manifest); set resume to false to recompute all movies
+resume = True
+## low-memory mode: float32 throughout, parcels processed in chunks whose working arrays stay below
+## memory_limit bytes (the ISC matrices and standardized time series are written straight to disk)
+low_memory = False
+memory_limit = 4 * 1024**3
+manifest = Manifest(os.path.join(dir_out, 'manifests', 'isc.json'))
+if incremental and MatrixStore.exists(isc_store_path):
+    # check the inputs of every movie before the store is grown on disk, so a run cannot stop halfway for
+    # a missing file; a run interrupted later is resumed by running it again (each movie keeps the number
+    # of subjects it was updated for in its standardized time series)
+    for movie in movie_list:
+        ts_path = os.path.join(dir_out, 'ISC_standardized_%s.npy' % movie)
+        if not os.path.exists(ts_path):
+            raise FileNotFoundError('Incremental mode needs the standardized time series %s of the previous run' % ts_path)
+        cube_subjects = load_timeseries_cube(os.path.join(mov_cube_path, '%s_timeseries' % movie), verify = False)[1]
+        if cube_subjects != list(subjlist['PID']):
+            raise ValueError('Subjects in the %s timeseries cube do not match the subjectlist' % movie)
+    isc_store = MatrixStore(isc_store_path, mode = 'r+')
+    new_subjects = [subj for subj in subjlist['PID'] if subj not in isc_store.subjects]
+    print('Adding %d new subjects to the ISC matrices of %d subjects' % (len(new_subjects), len(isc_store.subjects)))
+    isc_store = isc_store.add_subjects(new_subjects)
+elif resume and MatrixStore.exists(isc_store_path) and MatrixStore(isc_store_path).subjects == list(subjlist['PID']):
+    # keep the ISC matrices of the movies that are up to date
+    isc_store = MatrixStore(isc_store_path, mode = 'r+')
+else:
+    incremental = False
+    manifest.clear()
+    isc_store = MatrixStore.create(isc_store_path,
+        {'movie': movie_list, 'parcel': list(range(1, len(atlas_labels) + 1))}, subjlist['PID'],
+        dtype = np.float32 if low_memory else np.float64)
+
 ## where should the visualizations be stored?
 dir_out_vis = os.path.join(projpath, 'Scripts', '03_2ndLev_ISC', 'visualizations')
 if not os.path.exists(os.path.join(dir_out_vis)):
@@ -45,61 +89,150 @@ if not os.path.exists(os.path.join(dir_out_vis)):
 
 ## where should the csv results be stored?
 dir_out_bootstrap = os.path.join(projpath, 'Scripts', '03_2ndLev_ISC', 'py_output_permutation')
+n_jobs = 4 # number of worker processes rendering the figures
+n_bootstraps = 10000
+params = {'subjects': isc_store.subjects, 'n_bootstraps': n_bootstraps, 'low_memory': low_memory}
+## leave-one-out ISC: every subject correlated with the mean time series of all others
+## (linear in the number of subjects), computed for all movies after the pairwise ISC matrices
+## and tested with the subject-wise bootstrap ('bootstrap') or a sign-flip test ('permutation')
+loo = True
+loo_method = 'bootstrap'
+loo_params = {'subjects': list(subjlist['PID']), 'n_resamples': n_bootstraps, 'method': loo_method, 'low_memory': low_memory}
+
+## ISC values, confidence intervals, p-values and Bonferroni- and FDR-corrected p-values of all parcels
+def results_table(isc_stats):
+    return pd.DataFrame({'parcel': np.arange(1, len(isc_stats['isc']) + 1), 'label': atlas_labels['label'],
+        'ISC': isc_stats['isc'], 'ci_lower': isc_stats['ci_lower'], 'ci_upper': isc_stats['ci_upper'],
+        'p': isc_stats['p'], 'p_fwe': isc_stats['p_fwe'], 'p_fdr': isc_stats['p_fdr']})
+
+## mean ISC and FWE-corrected p-values of every movie (movies x parcels), plotted after all movies are done
+mean_isc = []
+mean_isc_p_fwe = []
 
 # create ISC matrices for each movie
-movie_list = ['movie1', 'movie2', 'movie3', 'movie4', 'movie5', 'movie6', 'movie7', 'movie8']
 # load the extracted time series for each movie
 for movie in movie_list:
-    sub_timeseries = [] # list to store the time series for each subject
-    for subj in subjlist['PID']:
-        # print('Loading data for Subject Nr. %s'% (subj))
-        sub_data = pd.read_csv(os.path.join(mov_csv_path, 'sub%s_%s_Average_ROI.csv' % (subj, movie)))
-        sub_timeseries.append(sub_data.values)
-    data = np.array(sub_timeseries)
+    cube_path = os.path.join(mov_cube_path, '%s_timeseries' % movie)
+    results_path = os.path.join(dir_out_bootstrap, 'ISC_%s.csv' % movie)
+    inputs = {'cube': cube_path + '.npy', 'cube_meta': cube_path + '.json'}
+    # (in incremental mode this skips the movies already updated by an interrupted run)
+    if resume and manifest.is_current(movie, inputs, params,
+            arrays = {'isc_matrices': isc_store.get(movie = movie)}):
+        print('%s: up to date' % movie)
+        df = pd.read_csv(results_path)
+        mean_isc.append(df['ISC'].values)
+        mean_isc_p_fwe.append(df['p_fwe'].values)
+        continue
+    with tracer.span('load', movie = movie) as span:
+        data, cube_subjects = load_timeseries_cube(cube_path)
+        span.items = len(cube_subjects)
+    if cube_subjects != list(subjlist['PID']):
+        raise ValueError('Subjects in the %s timeseries cube do not match the subjectlist' % movie)
+    # bring the subjects into the order of the matrix store (new subjects last in incremental mode)
+    if cube_subjects != isc_store.subjects:
+        data = data[[cube_subjects.index(subj) for subj in isc_store.subjects]]
     n_subs, n_ts, n_parcels = data.shape
-    # calculate the ISC matrix for each parcel
-    similarity_matrices = [] # list to store the ISC matrices for each parcel
-    for parcel in range(n_parcels):
-        # calculate the pairwise similarity between subjects
-        similarity_matrix = 1 - pairwise_distances(data[:, :, parcel], metric = 'correlation')
-        similarity_matrices.append(Adjacency(similarity_matrix, matrix_type='similarity'))
-        # put the ISC matrix into a Pandas DataFrame
-        df = pd.DataFrame(similarity_matrix, index = subjlist['PID'], columns = subjlist['PID'])
-        # save the ISC matrix as a CSV file
-        df.to_csv(os.path.join(dir_out, 'ISC_%s_parcel%s.csv' % (movie, parcel+1)), index = True, header = True)
-    ## generate a visualization of the mean ISC matrix across subjects
-    # extract the mean ISC values across subjects from the similarity matrices and put them into a dictionary
-    isc = {parcel:similarity_matrices[parcel].isc(metric='mean', n_bootstraps=1, n_jobs=1)['isc'] for parcel in range(n_parcels)}
-    isc_brain = roi_to_brain(pd.Series(isc), expand_mask(mask))
-    nplot.plot_glass_brain(isc_brain.to_nifti(),
-        colorbar = True, plot_abs = False,
-        cmap = "viridis",
-        vmin = -0.5, vmax = 0.5)
-    plt.savefig(os.path.join(dir_out_vis, 'Mean_ISC_%s.png' % movie), dpi = 400)
-    plt.close()
-    ## statistical testing of the ISC values
-    # calculate bootstrapped p-values for the ISC values
-    p = {parcel:similarity_matrices[parcel].isc(metric='mean', n_bootstraps=10000, n_jobs=1)['p'] for parcel in range(n_parcels)}
-    # create a Pandas DataFrame with the ISC values and p-values
-    df = pd.DataFrame({'ISC':isc, 'p':p})
-    # add column with Bonferroni-corrected p-values
-    df['p_fwe'] = df['p'] * n_parcels
-    # Add column with FDR-corrected p-values
-    reject, p_fdr = fdrcorrection(df['p'], alpha=0.05)
-    df['p_fdr'] = p_fdr
-    # add the parcel numbers to the DataFrame
-    df['parcel'] = np.arange(1, n_parcels+1)
-    # add the parcel names to the DataFrame
-    df['label'] = atlas_labels['label']
-    # reorder the columns
-    df = df[['parcel', 'label', 'ISC', 'p', 'p_fwe', 'p_fdr']]
-    # save the DataFrame as a CSV file
-    df.to_csv(os.path.join(dir_out_bootstrap, 'ISC_%s.csv' % movie), index = False)
-    ## generate a visualization of the mean ISC matrix only for significant parcels
-    # pval_brain = roi_to_brain(pd.Series(df.loc[:, 'p_fwe']), mask_x)
-    # display = nplot.plot_glass_brain(threshold(isc_brain, pval_brain, thr=0.05).to_nifti(),
-    #     cmap = "viridis", colorbar = True, plot_abs = False, vmin = -0.5, vmax = 0.5,
-    #     )
-    ## Save the plot to a file
-    # plt.savefig(os.path.join(dir_out_vis, 'Mean_ISC_%s_thresholded.png' % movie), dpi = 400); plt.close()
+    # standardized time series are kept for later incremental updates
+    ts_path = os.path.join(dir_out, 'ISC_standardized_%s.npy' % movie)
+    if low_memory and not incremental:
+        # calculate the ISC matrices and bootstrap statistics a bounded chunk of parcels at a time,
+        # writing the matrices to the store and the standardized time series to disk as they are done
+        # (chunked_isc traces the compute, write and bootstrap steps of every chunk)
+        ts = np.lib.format.open_memmap(ts_path, mode = 'w+', dtype = np.float32, shape = (n_parcels, n_subs, n_ts))
+        isc_stats = chunked_isc(data, out = isc_store.get(movie = movie), ts_out = ts,
+            n_bootstraps = n_bootstraps, memory_limit = memory_limit, labels = {'movie': movie})
+        del ts
+        isc_store.flush()
+    else:
+        with tracer.span('compute', movie = movie) as span:
+            span.items = n_parcels
+            if incremental:
+                # only correlate the new subjects with the whole cohort; the subjects this movie was last
+                # computed for are the first ones of the store
+                ts_old = np.load(ts_path)
+                n_old = ts_old.shape[1]
+                ts_new = standardize_timeseries(data[n_old:])
+                isc_matrices = update_isc(isc_store.get(movie = movie)[:, :n_old, :n_old], ts_old, ts_new)
+                ts = np.concatenate([ts_old, ts_new], axis = 1)
+            else:
+                # calculate the ISC matrices of all parcels at once (parcels x subjects x subjects)
+                ts = standardize_timeseries(data)
+                isc_matrices = isc_from_standardized(ts)
+        with tracer.span('write', movie = movie) as span:
+            # save the ISC matrices of all parcels to the matrix store, then the standardized time series
+            # (in this order, so time series of all subjects imply that their matrices are in the store)
+            isc_store.set(isc_matrices, movie = movie)
+            isc_store.flush()
+            np.save(ts_path, ts)
+            span.items = n_parcels
+        ## statistical testing of the ISC values
+        # subject-wise bootstrap of the mean ISC, with the same resamples applied to all parcels
+        with tracer.span('bootstrap', movie = movie) as span:
+            isc_stats = bootstrap_isc(isc_matrices, n_bootstraps=n_bootstraps)
+            span.items = n_parcels
+        del ts, isc_matrices
+    mean_isc.append(isc_stats['isc'])
+    mean_isc_p_fwe.append(isc_stats['p_fwe'])
+    # save the ISC values, confidence intervals and bootstrapped p-values as a CSV file
+    results_table(isc_stats).to_csv(results_path, index = False)
+    manifest.record(movie, inputs, params, outputs = [ts_path, results_path],
+        arrays = {'isc_matrices': isc_store.get(movie = movie)})
+    manifest.save()
+    peak_rss_mb = max(record['peak_rss_mb'] for record in tracer.records if record['labels'].get('movie') == movie)
+    print('%s: peak resident memory %.2f GB' % (movie, peak_rss_mb / 1024))
+
+## leave-one-out ISC of every movie, written in the format of the pairwise results (ISC_loo_<movie>.csv)
+## together with the ISC of every subject and parcel (ISC_loo_values_<movie>.csv)
+for movie in (movie_list if loo else []):
+    cube_path = os.path.join(mov_cube_path, '%s_timeseries' % movie)
+    inputs = {'cube': cube_path + '.npy', 'cube_meta': cube_path + '.json'}
+    loo_values_path = os.path.join(dir_out, 'ISC_loo_values_%s.csv' % movie)
+    loo_results_path = os.path.join(dir_out_bootstrap, 'ISC_loo_%s.csv' % movie)
+    if resume and manifest.is_current('%s_loo' % movie, inputs, loo_params):
+        print('%s: leave-one-out ISC up to date' % movie)
+        continue
+    with tracer.span('load', movie = movie, mode = 'loo') as span:
+        data, cube_subjects = load_timeseries_cube(cube_path)
+        span.items = len(cube_subjects)
+    if cube_subjects != list(subjlist['PID']):
+        raise ValueError('Subjects in the %s timeseries cube do not match the subjectlist' % movie)
+    with tracer.span('compute', movie = movie, mode = 'loo') as span:
+        loo_values = loo_isc(data, dtype = np.float32 if low_memory else np.float64)
+        span.items = len(loo_values)
+    with tracer.span('bootstrap', movie = movie, mode = 'loo') as span:
+        loo_stats = loo_inference(loo_values, method = loo_method, n_resamples = n_bootstraps)
+        span.items = len(loo_values)
+    with tracer.span('write', movie = movie, mode = 'loo'):
+        pd.DataFrame(loo_values, index = pd.Index(np.arange(1, len(loo_values) + 1), name = 'parcel'),
+            columns = cube_subjects).to_csv(loo_values_path)
+        results_table(loo_stats).to_csv(loo_results_path, index = False)
+    manifest.record('%s_loo' % movie, inputs, loo_params, outputs = [loo_values_path, loo_results_path])
+    manifest.save()
+
+## generate a visualization of the mean ISC across subjects of every movie (rendered in parallel)
+with tracer.span('plot') as span:
+    rendered = render_glass_brains(mask, mean_isc, [os.path.join(dir_out_vis, 'Mean_ISC_%s.png' % movie) for movie in movie_list],
+        dict(colorbar = True, plot_abs = False, cmap = "viridis", vmin = -0.5, vmax = 0.5), dpi = 400, n_jobs = n_jobs)
+    span.items = len(rendered)
+## generate a visualization of the mean ISC only for significant parcels
+# render_glass_brains(mask, np.where(np.array(mean_isc_p_fwe) < 0.05, mean_isc, 0),
+#     [os.path.join(dir_out_vis, 'Mean_ISC_%s_thresholded.png' % movie) for movie in movie_list],
+#     dict(colorbar = True, plot_abs = False, cmap = "viridis", vmin = -0.5, vmax = 0.5), dpi = 400, n_jobs = n_jobs)
+
+## add the pairs of new subjects to the pair index and the real/pseudo pair lists: the lists are rebuilt
+## from real_pair_list.csv and the subjects of the matrix store, so the dyads of new subjects have to be
+## added to real_pair_list.csv by hand (subjects not listed there only get pseudo pairs)
+if incremental:
+    real_pairs_df = pd.read_csv(os.path.join(projpath, 'MRI', 'real_pair_list.csv'))
+    pair_index = PairIndex.from_real_pairs(real_pairs_df['PairID'], subjects = isc_store.subjects)
+    pair_index.save(os.path.join(projpath, 'MRI', 'pair_index.npz'))
+    for pair_file, ordered in [('all_pair_list.csv', False), ('all_pair_list_with_reverse.csv', True)]:
+        pair_index.frame(ordered = ordered).to_csv(os.path.join(projpath, 'MRI', pair_file), index = False)
+
+## optionally export the stored ISC matrices as CSV files (one per movie and parcel)
+if export_csv:
+    with tracer.span('export'):
+        isc_store.export_csv(dir_out, 'ISC_{movie}_parcel{parcel}.csv')
 
+## summary of the time and memory used by every step
+tracer.summary()
@@ -1,12 +1,16 @@
 #!/usr/bin/env python
 import os
+import sys
 import pandas as pd
 
-from nilearn import masking as nmask
-from bids.layout import BIDSLayout
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from movie_variability.masking import find_brain_masks, group_mask
+from movie_variability.trace import Tracer
 
 
 ### create mask across subjects
+## timing and memory of every step are appended to pipeline_logs/trace/create_movies_mask.jsonl
+tracer = Tracer('create_movies_mask')
 
 # project location
 proj_path = '/project/3011157.03/Simon/proj_2022_CABB_movie/MRI'
@@ -22,18 +26,31 @@ subjlist = pd.read_csv(os.path.join(proj_path, 'subjectlist.csv'), dtype = objec
 
 # where should mask be stored?
 dir_out = proj_path
-
-# get all paths
-layout = BIDSLayout(fmriprep_path, derivatives = True)
+n_jobs = 4 # number of worker processes reading the subject masks
 
 # get paths of masks per subject
-mask_list = []
-for subj in subjlist['PID']:
-    func_mask_files = layout.get(subject = subj, datatype = 'func',
-    suffix = 'mask', desc = 'brain', space = 'MNI152NLin2009cAsym',
-    extension = "nii.gz", return_type = 'filename')
-    mask_list.append(func_mask_files[0])
+use_layout = False # set to true to look the masks up with a BIDSLayout (indexed once, then read from its database)
+if use_layout:
+    from bids.layout import BIDSLayout
+    layout = BIDSLayout(fmriprep_path, derivatives = True,
+        database_path = os.path.join(proj_path, '.bids_layout_db'))
+    mask_list = []
+    for subj in subjlist['PID']:
+        func_mask_files = layout.get(subject = subj, datatype = 'func',
+        suffix = 'mask', desc = 'brain', space = 'MNI152NLin2009cAsym',
+        extension = "nii.gz", return_type = 'filename')
+        mask_list.append(func_mask_files[0])
+else:
+    # resolve the fMRIPrep mask file names directly
+    mask_list = find_brain_masks(os.path.join(fmriprep_path, 'derivatives'), subjlist['PID'])
 
 ## calculate a group mask using the conjunction of all subjects
-groupmask = nmask.intersect_masks(mask_list, threshold = 0.8)
-groupmask.to_filename(os.path.join(dir_out, 'groupmask_movies.nii.gz'))
+## (voxels in more than 80% of the subject masks, largest connected component, as nilearn.masking.intersect_masks)
+with tracer.span('compute') as span:
+    groupmask = group_mask(mask_list, threshold = 0.8, n_jobs = n_jobs)
+    span.items = len(mask_list)
+with tracer.span('write'):
+    groupmask.to_filename(os.path.join(dir_out, 'groupmask_movies.nii.gz'))
+
+## summary of the time and memory used by every step
+tracer.summary()
@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+## this script exports the ISC values of all pairs of subjects for each movie and parcel
+## into one long-format Parquet dataset (partitioned by movie and parcel)
+## It reads each ISC matrix once and covers both the full (ordered) and the upper-triangle pairs:
+## rows of the upper-triangle pair list are flagged with is_upper.
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from movie_variability.export import export_pair_dataset
+from movie_variability.pairs import PairIndex
+from movie_variability.pipeline import shard_values
+from movie_variability.store import MatrixStore
+from movie_variability.trace import Tracer
+
+# Timing and memory of every step are appended to pipeline_logs/trace/create_pair_dataset[_<shard>].jsonl
+# (load and write spans per movie)
+tracer = Tracer('create_pair_dataset')
+
+# Load the pair index (all ordered pairs, and the upper-triangle pairs)
+data_dir = Path('/project/3011157.03/Simon/proj_2022_CABB_movie/MRI')
+pair_index = PairIndex.load(data_dir / 'pair_index.npz')
+
+# Define the directory where the similarity matrices are stored (memory-mapped matrix store)
+matrix_dir = Path('/project/3011157.03/Simon/proj_2022_CABB_movie/Scripts/03_2ndLev_ISC/matrices')
+isc_store = MatrixStore(matrix_dir / 'ISC_matrices')
+
+# Directory to save the results
+output_dir = Path('/project/3011157.03/Simon/proj_2022_CABB_movie/Scripts/03_2ndLev_ISC/dataframes')
+if not output_dir.exists():
+    output_dir.mkdir(exist_ok=True)
+    print(f'Created directory: {output_dir}')
+
+# Write the dataset (Movie=movieX/Parcel=parcelY/part-0.parquet)
+# (only the movies of this shard when run as a sharded pipeline job)
+export_pair_dataset(isc_store, pair_index, output_dir / 'ISC_pairs', 'Correlation',
+    movies=shard_values('movie', isc_store.coords['movie']))
+
+## summary of the time and memory used by every step
+tracer.summary()
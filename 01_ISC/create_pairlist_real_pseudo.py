@@ -1,30 +1,23 @@
 # Create a list of all possible pairs of participants,
 # and indicate if the pair is real or pseudo based on the real pair list.
+# The pairs are also saved as a binary pair index (integer subject codes, index arrays
+# of the upper-triangle and ordered pairs, real-dyad masks) used by the later stages.
+import sys
 import pandas as pd
-from itertools import combinations
+from pathlib import Path
 
-# Load the CSV file containing real pairs
-real_pairs_df = pd.read_csv("/project/3011157.03/Simon/proj_2022_CABB_movie/MRI/real_pair_list.csv")
-
-# Extract participants from the PairID column and generate all possible pairs
-participants = set()
-real_pairs_df['PairID'].apply(lambda x: participants.update(x.split('_')))
-all_possible_pairs = list(combinations(sorted(participants), 2))
-
-# Create a dataframe for all pairs
-all_pairs_df = pd.DataFrame(all_possible_pairs, columns=['Subject1', 'Subject2'])
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from movie_variability.pairs import PairIndex
 
-# Define a function to determine pair type
-def determine_pair_type(row, real_pairs):
-    pair = f"{row['Subject1']}_{row['Subject2']}"
-    return 'Real' if pair in real_pairs else 'Pseudo'
+data_dir = Path('/project/3011157.03/Simon/proj_2022_CABB_movie/MRI')
 
-# Add a column to indicate if the pair is real or pseudo
-all_pairs_df['Pair_Type'] = all_pairs_df.apply(determine_pair_type, args=(set(real_pairs_df['PairID']),), axis=1)
-
-# Sort the dataframe: first by 'Pair_Type' to place 'Real' first, then by 'Subject1' and 'Subject2'
-all_pairs_df = all_pairs_df.sort_values(by=['Pair_Type', 'Subject1', 'Subject2'], ascending=[False, True, True])
+# Load the CSV file containing real pairs
+real_pairs_df = pd.read_csv(data_dir / 'real_pair_list.csv')
 
-# Save the sorted dataframe to a CSV file
-all_pairs_df.to_csv('/project/3011157.03/Simon/proj_2022_CABB_movie/MRI/all_pair_list.csv', index=False)
+# Generate all possible pairs of the participants of the real pairs
+# (sorted: 'Real' first, then by 'Subject1' and 'Subject2')
+pair_index = PairIndex.from_real_pairs(real_pairs_df['PairID'])
+pair_index.save(data_dir / 'pair_index.npz')
 
+# Save the sorted pair list to a CSV file
+pair_index.frame().to_csv(data_dir / 'all_pair_list.csv', index=False)
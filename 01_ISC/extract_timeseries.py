@@ -1,16 +1,23 @@
 #!/usr/bin/env python
 import os
+import sys
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
 
-from nltools.data import Brain_Data
-from nltools.mask import expand_mask
-
-from nilearn import plotting as nplot
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from movie_variability.atlas import Atlas
+from movie_variability.extraction import extract_cube
+from movie_variability.manifest import Manifest
+from movie_variability.pipeline import shard_values
+from movie_variability.store import save_timeseries_cube, load_timeseries_cube
+from movie_variability.trace import Tracer
 
 import warnings
 warnings.filterwarnings("ignore") # suppress warnings
 
+## timing and memory of every step are appended to pipeline_logs/trace/extract_timeseries[_<shard>].jsonl
+tracer = Tracer('extract_timeseries')
+
 ## location of main project directory on HPC
 projpath = '/project/3011157.03/Simon/proj_2022_CABB_movie/MRI'
 print('The main project directory is located here: %s' % projpath)
@@ -26,37 +33,99 @@ mask_path = os.path.join(projpath, 'groupmask_movies.nii.gz')
 ## get brain parcellation (k = 210 cortical parcels; "Brainnetome" atlas, Fan et al. 2016, Cerebral Cortex)
 mask_name = 'Brainnetome'
 brainnetome_path = os.path.join(projpath, 'Brainnetome_atlas', 'BN_Atlas_210_cortical_2mm.nii.gz')
-mask = Brain_Data(brainnetome_path, mask = mask_path)
-mask_x = expand_mask(mask)
+mask = Atlas.load(brainnetome_path, mask_path) # cached atlas restricted to the group mask
 atlas_labels = pd.read_csv(os.path.join(projpath, 'Brainnetome_atlas/Brainnetome_labels_cortical.csv'))
+## parcellations to extract, all computed from a single read of each functional run
+## (add further atlases on the same 2mm grid here, e.g. {'Brainnetome': ..., 'Schaefer200': ...})
+atlas_paths = {mask_name: brainnetome_path}
 
-## where should the results be stored?
-dir_out = os.path.join(fmriprep_dir, 'derivatives', 'secLev_nltools_ISC_ROI', mask_name)
+## where should the results be stored? (one directory per atlas)
+dir_out_root = os.path.join(fmriprep_dir, 'derivatives', 'secLev_nltools_ISC_ROI')
+dir_out = os.path.join(dir_out_root, mask_name)
 if not os.path.exists(os.path.join(dir_out)):
     os.makedirs(os.path.join(dir_out))
     print('Dir %s created ' % dir_out)
 
-plot_atlas = True # set to true if you want to plot the atlas
-if plot_atlas:
-    nplot.plot_roi(
-        mask.to_nifti(),
-        title='%s Parcellation' % mask_name)
-    plt.savefig(os.path.join(dir_out, 'CorticalParcels_%s.png' % mask_name))
-    plt.close()
-
-
-## extract average activation from atlas and save to csv
-extract_csv = True # set to false if csv files have already been created
-## location of csv files
-dir_out_csv = os.path.join(dir_out, 'csv_files')
-if extract_csv:
-    if not os.path.exists(dir_out_csv):
-        os.makedirs(dir_out_csv)
-        print('Dir %s created ' % dir_out_csv)
-    for scan in ['movie1', 'movie2', 'movie3', 'movie4', 'movie5', 'movie6', 'movie7', 'movie8']:
-        for subj in subjlist['PID']:
-            # print('Loading data for Subject Nr. %s'% (subj))
-            data = Brain_Data(os.path.join(movpath, 'sub-%s' % subj, 's_%s_img.nii.gz' % (scan)), mask = mask_path)
-            roi = data.extract_roi(mask)
-            pd.DataFrame(roi.T).to_csv(os.path.join(dir_out_csv, 'sub%s_%s_Average_ROI.csv' % (subj, scan)),
-                index = False)
+plot_atlas = True # set to true if you want to plot the atlas (once; an existing figure is kept)
+atlas_figure = os.path.join(dir_out, 'CorticalParcels_%s.png' % mask_name)
+if plot_atlas and not os.path.exists(atlas_figure):
+    # the plotting stack is only imported when the figure is drawn
+    import matplotlib.pyplot as plt
+    from nilearn import plotting as nplot
+    with tracer.span('plot'):
+        nplot.plot_roi(
+            mask.label_image(),
+            title='%s Parcellation' % mask_name)
+        plt.savefig(atlas_figure)
+        plt.close()
+
+
+## extract average activation from every atlas and save one (subjects x TRs x parcels) cube per atlas and movie
+## subjects whose run, atlases and mask are unchanged since the last run are taken from the existing cubes
+## (recorded in one manifest per movie); set resume to false to extract all subjects again
+resume = True
+export_csv = False # set to true to additionally write one csv file per atlas, subject and movie
+streaming = True # set to false to load every run as a whole into Brain_Data and use extract_roi
+n_jobs = 8 # number of worker processes (subjects extracted in parallel) in streaming mode
+chunk_size = 50 # number of TRs read at once per worker in streaming mode
+## location of timeseries cubes and csv files
+dir_out_cubes = {name: os.path.join(dir_out_root, name, 'cubes') for name in atlas_paths}
+dir_out_csv = {name: os.path.join(dir_out_root, name, 'csv_files') for name in atlas_paths}
+for name in atlas_paths:
+    for dir_name in [dir_out_cubes[name]] + ([dir_out_csv[name]] if export_csv else []):
+        if not os.path.exists(dir_name):
+            os.makedirs(dir_name)
+            print('Dir %s created ' % dir_name)
+if streaming:
+    # cached voxel -> parcel operators, shared by all workers
+    atlases = {name: Atlas.load(path, mask_path) for name, path in atlas_paths.items()}
+else:
+    from nltools.data import Brain_Data
+    atlas_masks = {name: Brain_Data(path, mask = mask_path) for name, path in atlas_paths.items()}
+atlas_inputs = dict({'mask': mask_path}, **{'atlas_%s' % name: path for name, path in atlas_paths.items()})
+# (only the movies of this shard when run as a sharded pipeline job)
+for scan in shard_values('movie', ['movie1', 'movie2', 'movie3', 'movie4', 'movie5', 'movie6', 'movie7', 'movie8']):
+    manifest = Manifest(os.path.join(dir_out_root, 'manifests', 'extract_%s.json' % scan))
+    cube_paths = {name: os.path.join(dir_out_cubes[name], '%s_timeseries' % scan) for name in atlas_paths}
+    run_paths = [os.path.join(movpath, 'sub-%s' % subj, 's_%s_img.nii.gz' % (scan)) for subj in subjlist['PID']]
+    run_inputs = [dict(atlas_inputs, run = run_path) for run_path in run_paths]
+    todo = [i for i, subj in enumerate(subjlist['PID'])
+        if not (resume and manifest.is_current('sub-%s' % subj, run_inputs[i]))]
+    if not todo:
+        print('%s: all subjects up to date' % scan)
+        continue
+    print('%s: extracting %d of %d subjects' % (scan, len(todo), len(run_paths)))
+    with tracer.span('compute', movie = scan) as span:
+        if streaming:
+            # stream each run in chunks of TRs and reduce the voxels to parcel means of every atlas
+            new_cubes = extract_cube([run_paths[i] for i in todo], atlases, chunk_size = chunk_size, n_jobs = n_jobs)
+        else:
+            sub_timeseries = {name: [] for name in atlas_paths} # lists to store the time series for each subject
+            for i in todo:
+                # print('Loading %s'% (run_paths[i]))
+                data = Brain_Data(run_paths[i], mask = mask_path)
+                for name, atlas_mask in atlas_masks.items():
+                    sub_timeseries[name].append(data.extract_roi(atlas_mask).T)
+            new_cubes = {name: np.array(ts) for name, ts in sub_timeseries.items()}
+        span.items = len(todo)
+    with tracer.span('write', movie = scan) as span:
+        for name, new_cube in new_cubes.items():
+            if len(todo) < len(run_paths):
+                # keep the up-to-date subjects of the existing cube (rows of new subjects are replaced below)
+                old_cube, old_subjects = load_timeseries_cube(cube_paths[name])
+                cube = np.array(old_cube[[old_subjects.index(subj) if subj in old_subjects else 0 for subj in subjlist['PID']]])
+                cube[todo] = new_cube
+            else:
+                cube = new_cube
+            save_timeseries_cube(cube_paths[name], cube, subjlist['PID'])
+            if export_csv:
+                for i, roi in zip(todo, new_cube):
+                    pd.DataFrame(roi).to_csv(os.path.join(dir_out_csv[name], 'sub%s_%s_Average_ROI.csv' % (subjlist['PID'][i], scan)),
+                        index = False)
+        span.items = len(todo)
+    for i, subj in enumerate(subjlist['PID']):
+        manifest.record('sub-%s' % subj, run_inputs[i], outputs = [path + '.npy' for path in cube_paths.values()])
+    manifest.save()
+
+## summary of the time and memory used by every step
+tracer.summary()
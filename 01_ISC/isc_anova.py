@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+## this script runs a parcel-wise repeated-measures ANOVA to detect differences in ISC between movies
+## (Python alternative to the ANOVA part of isc_movie_comparison.R)
+## The ISC values of the real pairs (upper triangle) are read directly from the ISC matrices
+## and the F and p values of all parcels are computed at once.
+## The results are written to isc_anova.csv in the format of the R script (used by visualize_anova.py).
+
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from movie_variability.pairs import PairIndex
+from movie_variability.stats import rm_anova
+from movie_variability.store import MatrixStore
+from movie_variability.trace import Tracer
+
+## timing and memory of every step are appended to pipeline_logs/trace/isc_anova.jsonl
+tracer = Tracer('isc_anova')
+
+## location of main project directory on HPC
+proj_path = '/project/3011157.03/Simon/proj_2022_CABB_movie/'
+## location of the ISC matrices
+matrix_dir = os.path.join(proj_path, 'Scripts', '03_2ndLev_ISC', 'matrices')
+## where should the results be stored?
+out_dir = os.path.join(proj_path, 'Scripts', '03_2ndLev_ISC', 'r_output_anova')
+if not os.path.exists(out_dir):
+    os.makedirs(out_dir, exist_ok=True)
+    print('Directory %s created' % out_dir)
+## Brainnetome labels
+labels = pd.read_csv(os.path.join(proj_path, 'MRI', 'Brainnetome_atlas', 'Brainnetome_labels_cortical.csv'))
+yeo_networks = {0: 'Other', 1: 'Visual', 2: 'Somatomotor', 3: 'Dorsal Attention', 4: 'Ventral Attention',
+    5: 'Limbic', 6: 'Frontoparietal', 7: 'Default'}
+
+## ISC values of the real pairs of the upper triangle (pairs x movies x parcels)
+pair_index = PairIndex.load(os.path.join(proj_path, 'MRI', 'pair_index.npz'))
+isc_store = MatrixStore(os.path.join(matrix_dir, 'ISC_matrices'))
+rows, cols = pair_index.indices(isc_store.subjects, real_only = True)
+with tracer.span('load') as span:
+    isc_values = np.stack([isc_store.get(movie = movie)[:, rows, cols].T for movie in isc_store.coords['movie']], axis = 1)
+    span.items = isc_values.shape[1]
+
+## within-subject (pair) ANOVA with movie as factor, Bonferroni-corrected across parcels
+with tracer.span('compute') as span:
+    Fval, p = rm_anova(isc_values)
+    span.items = len(Fval)
+results_df = pd.DataFrame({'Parcel': isc_store.coords['parcel'], 'Fval': Fval, 'p': p,
+    'pfwe': np.minimum(p * len(p), 1)})
+
+## join labels and map the Yeo 7 network integers to network names
+results_df = results_df.merge(labels, how = 'left', left_on = 'Parcel', right_on = 'one_based')
+results_df = results_df.drop(columns = ['one_based', 'zero_based'])
+results_df['Yeo_7network'] = results_df['Yeo_7network'].map(yeo_networks).fillna(results_df['Yeo_7network'])
+with tracer.span('write'):
+    results_df.to_csv(os.path.join(out_dir, 'isc_anova.csv'), index = False)
+
+## summary of the time and memory used by every step
+tracer.summary()
@@ -1,5 +1,8 @@
 ### Submit script "XY.py" to HPC (Torque) cluster
 import subprocess
 
-subprocess.run(['echo "$PWD/create_isc_matrices.py" | qsub -l nodes=1:ppn=1,walltime=48:00:00,mem=128gb -N create_matrices'], 
+subprocess.run(['echo "$PWD/create_isc_matrices.py" | qsub -l nodes=1:ppn=4,walltime=02:00:00,mem=128gb -N create_matrices'], 
     shell = True)
+## with low_memory = True in create_isc_matrices.py the job fits on a 16 GB worker
+# subprocess.run(['echo "$PWD/create_isc_matrices.py" | qsub -l nodes=1:ppn=4,walltime=02:00:00,mem=16gb -N create_matrices'],
+#     shell = True)
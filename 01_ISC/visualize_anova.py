@@ -5,14 +5,17 @@
 
 ## import libraries
 import os
+import sys
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
 
-from nltools.data import Brain_Data
-from nltools.mask import expand_mask, roi_to_brain
-from nltools.stats import threshold
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from movie_variability.atlas import Atlas
+from movie_variability.render import render_glass_brains
+from movie_variability.trace import Tracer
 
-from nilearn import plotting as nplot
+## timing and memory of every step are appended to pipeline_logs/trace/visualize_anova.jsonl
+tracer = Tracer('visualize_anova')
 
 ## location of main project directory on HPC
 proj_path = '/project/3011157.03/Simon/proj_2022_CABB_movie/'
@@ -29,27 +32,29 @@ mask_path = os.path.join(proj_path, 'MRI', 'groupmask_movies.nii.gz')
 ## get brain parcellation (k = 210; Brainnetome)
 mask_name = 'Brainnetome'
 brainnetome_path = os.path.join(proj_path, 'MRI','Brainnetome_atlas', 'BN_Atlas_210_cortical_2mm.nii.gz')
-mask = Brain_Data(brainnetome_path, mask = mask_path)
-mask_x = expand_mask(mask)
+mask = Atlas.load(brainnetome_path, mask_path) # cached atlas restricted to the group mask
 ## location of F and p values
 pvalues_csv = os.path.join(in_path, 'isc_anova.csv')
 # Load results data
 pvalues_df = pd.read_csv(pvalues_csv)
 
 ## visualize F-vals and thresholded tvals within glass brain and write niftis
-beta_brain = roi_to_brain(pd.Series(pvalues_df.loc[:, 'Fval']), mask_x)
-pval_brain = roi_to_brain(pd.Series(pvalues_df.loc[:, 'pfwe']), mask_x)
+beta_values = pvalues_df.loc[:, 'Fval'].values
+pval_values = pvalues_df.loc[:, 'pfwe'].values
+# threshold in parcel space (keep parcels with p < .05) before projecting to voxels
+beta_thresholded = np.where(pval_values < 0.05, beta_values, 0)
 
 ## plot and write unthreshoded image
-# nplot.plot_glass_brain(beta_brain.to_nifti(),
-#     colorbar = True, plot_abs = False)
-# plt.savefig(os.path.join(out_dir, 'ANOVA_ISC_movie_comparison_unthresholded.png'), dpi = 400); plt.close()
-# beta_brain.to_nifti().to_filename(os.path.join(out_dir, 'ANOVA_ISC_movie_comparison_unthresholded.nii.gz'))
-
-## plot and write threshoded image
-display = nplot.plot_glass_brain(threshold(beta_brain, pval_brain, thr=0.05).to_nifti(),
-    colorbar = True, plot_abs = False, cmap = "plasma", vmin = 0, vmax = 20
-    )
-# Save the plot to a file
-plt.savefig(os.path.join(out_dir, 'ANOVA_ISC_movie_comparison.png'), dpi = 400); plt.close()
-# threshold(beta_brain, pval_brain, thr=0.05).to_nifti().to_filename(os.path.join(out_dir, 'ANOVA_ISC_movie_comparisons.nii.gz'))
+# render_glass_brains(mask, beta_values, [os.path.join(out_dir, 'ANOVA_ISC_movie_comparison_unthresholded.png')],
+#     dict(colorbar = True, plot_abs = False), dpi = 400)
+# mask.to_nifti(beta_values).to_filename(os.path.join(out_dir, 'ANOVA_ISC_movie_comparison_unthresholded.nii.gz'))
+
+## plot and write threshoded image (skipped if the results are unchanged)
+with tracer.span('plot') as span:
+    rendered = render_glass_brains(mask, beta_thresholded, [os.path.join(out_dir, 'ANOVA_ISC_movie_comparison.png')],
+        dict(colorbar = True, plot_abs = False, cmap = "plasma", vmin = 0, vmax = 20), dpi = 400)
+    span.items = len(rendered)
+# mask.to_nifti(beta_thresholded).to_filename(os.path.join(out_dir, 'ANOVA_ISC_movie_comparisons.nii.gz'))
+
+## summary of the time and memory used by every step
+tracer.summary()
@@ -1,12 +1,17 @@
 #!/usr/bin/env python
 import os
+import sys
 import pandas as pd
 import numpy as np
 
-from nltools.data import Brain_Data, Adjacency
-from nltools.mask import expand_mask
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from movie_variability.isc import pairwise_distance
+from movie_variability.manifest import Manifest
+from movie_variability.store import MatrixStore, load_timeseries_cube
+from movie_variability.trace import Tracer
 
-from sklearn.metrics import pairwise_distances
+## timing and memory of every step are appended to pipeline_logs/trace/create_is-distance_matrices.jsonl
+tracer = Tracer('create_is-distance_matrices')
 
 ## location of main project directory on HPC
 projpath = '/project/3011157.03/Simon/proj_2022_CABB_movie/'
@@ -20,12 +25,10 @@ mask_path = os.path.join(projpath, 'MRI', 'groupmask_movies.nii.gz')
 ## get brain parcellation (k = 210 cortical parcels; "Brainnetome" atlas, Fan et al. 2016, Cerebral Cortex)
 mask_name = 'Brainnetome'
 brainnetome_path = os.path.join(projpath, 'MRI', 'Brainnetome_atlas', 'BN_Atlas_210_cortical_2mm.nii.gz')
-mask = Brain_Data(brainnetome_path, mask = mask_path)
-mask_x = expand_mask(mask)
 atlas_labels = pd.read_csv(os.path.join(projpath, 'MRI', 'Brainnetome_atlas/Brainnetome_labels_cortical.csv'))
 
-## location of extracted movie fMRI time series
-mov_csv_path = os.path.join(fmriprep_dir, 'derivatives', 'secLev_nltools_ISC_ROI', mask_name, 'csv_files')
+## location of extracted movie fMRI time series (one subjects x TRs x parcels cube per movie)
+mov_cube_path = os.path.join(fmriprep_dir, 'derivatives', 'secLev_nltools_ISC_ROI', mask_name, 'cubes')
 
 ## where should the ISC matrices be stored?
 dir_out = os.path.join(projpath, 'Scripts', '04_2ndLev_ISRSA', 'matrices')
@@ -35,22 +38,49 @@ if not os.path.exists(os.path.join(dir_out)):
 
 # create ISC matrices for each movie
 movie_list = ['movie1', 'movie2', 'movie3', 'movie4', 'movie5', 'movie6', 'movie7', 'movie8']
+## store all distance matrices in one memory-mapped (movie x parcel x subject x subject) array
+distance_store_path = os.path.join(dir_out, 'distance_matrices')
+## movies whose timeseries cube is unchanged since the last run are skipped (recorded in a manifest);
+## set resume to false to recompute all movies
+resume = True
+manifest = Manifest(os.path.join(dir_out, 'manifests', 'distance.json'))
+if resume and MatrixStore.exists(distance_store_path) and MatrixStore(distance_store_path).subjects == list(subjlist['PID']):
+    distance_store = MatrixStore(distance_store_path, mode = 'r+')
+else:
+    distance_store = MatrixStore.create(distance_store_path,
+        {'movie': movie_list, 'parcel': list(range(1, len(atlas_labels) + 1))}, subjlist['PID'])
+    manifest.clear()
+params = {'subjects': distance_store.subjects}
+export_csv = False # set to true to additionally write one CSV file per movie and parcel
 # load the extracted time series for each movie
 for movie in movie_list:
-    sub_timeseries = [] # list to store the time series for each subject
-    for subj in subjlist['PID']:
-        # print('Loading data for Subject Nr. %s'% (subj))
-        sub_data = pd.read_csv(os.path.join(mov_csv_path, 'sub%s_%s_Average_ROI.csv' % (subj, movie)))
-        sub_timeseries.append(sub_data.values)
-    data = np.array(sub_timeseries)
+    cube_path = os.path.join(mov_cube_path, '%s_timeseries' % movie)
+    inputs = {'cube': cube_path + '.npy', 'cube_meta': cube_path + '.json'}
+    if resume and manifest.is_current(movie, inputs, params, arrays = {'distance_matrices': distance_store.get(movie = movie)}):
+        print('%s: up to date' % movie)
+        continue
+    with tracer.span('load', movie = movie) as span:
+        data, cube_subjects = load_timeseries_cube(cube_path)
+        span.items = len(cube_subjects)
+    if cube_subjects != list(subjlist['PID']):
+        raise ValueError('Subjects in the %s timeseries cube do not match the subjectlist' % movie)
     n_subs, n_ts, n_parcels = data.shape
-    # calculate the ISC matrix for each parcel
-    similarity_matrices = [] # list to store the ISC matrices for each parcel
-    for parcel in range(n_parcels):
-        # calculate the pairwise similarity between subjects
-        similarity_matrix = pairwise_distances(data[:, :, parcel], metric = 'correlation') # correlation distance
-        similarity_matrices.append(Adjacency(similarity_matrix, matrix_type='distance'))
-        # put the ISC matrix into a Pandas DataFrame
-        df = pd.DataFrame(similarity_matrix, index = subjlist['PID'], columns = subjlist['PID'])
-        # save the ISC matrix as a CSV file
-        df.to_csv(os.path.join(dir_out, '%s_parcel%s.csv' % (movie, parcel+1)), index = True, header = True)
+    # calculate the correlation distance matrices of all parcels at once (parcels x subjects x subjects)
+    with tracer.span('compute', movie = movie) as span:
+        distance_matrices = pairwise_distance(data)
+        span.items = n_parcels
+    # save the distance matrices of all parcels to the matrix store
+    with tracer.span('write', movie = movie) as span:
+        distance_store.set(distance_matrices, movie = movie)
+        distance_store.flush()
+        span.items = n_parcels
+    manifest.record(movie, inputs, params, arrays = {'distance_matrices': distance_store.get(movie = movie)})
+    manifest.save()
+
+## optionally export the stored distance matrices as CSV files (one per movie and parcel)
+if export_csv:
+    with tracer.span('export'):
+        distance_store.export_csv(dir_out, '{movie}_parcel{parcel}.csv')
+
+## summary of the time and memory used by every step
+tracer.summary()
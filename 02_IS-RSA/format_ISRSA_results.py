@@ -1,7 +1,14 @@
 #!/usr/bin/env python
 import os
+import sys
 import pandas as pd
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from movie_variability.trace import Tracer
+
+## timing and memory are appended to pipeline_logs/trace/format_ISRSA_results.jsonl
+tracer = Tracer('format_ISRSA_results')
+
 ## location of main project directory on HPC
 proj_path = '/project/3011157.03/Simon/proj_2022_CABB_movie/'
 ## location of R output files to visualize
@@ -33,22 +40,27 @@ network_mapping = {
 labels_df['Yeo_7network'] = labels_df['Yeo_7network'].replace(network_mapping)
 
 ## format the results
-for i, f in enumerate(task_flist):
-    for j, m in enumerate(["movie1", "movie2", "movie3", "movie4", "movie5", "movie6", "movie7", "movie8"]):
-        print(f)
-        print(m)
-        tmp_df = pd.read_csv(os.path.join(r_path, f + m + '.csv'))
-        # Merging the values from the labels to match the node values from the results csv
-        merged_df = pd.merge(labels_df, tmp_df, left_on='one_based', right_on='Parcel')
-
-        # Specify the order of columns you want to retain
-        columns_order = ['Parcel', 'label', 'Yeo_7network', 
-                        'estimate', 'statistic', 'pval',
-                        'pvalFDR','pvalFWE']
-
-        # Reorder the DataFrame and drop any columns not listed
-        merged_df = merged_df[columns_order]
-        # Filter the DataFrame to only include significant results
-        filtered_df = merged_df[merged_df['pvalFWE'] < 0.05]
-        # Save the merged DataFrame to a new CSV file
-        filtered_df.to_csv(os.path.join(out_dir, f + m + '.csv'), index=False)
\ No newline at end of file
+with tracer.span('write') as span:
+    for i, f in enumerate(task_flist):
+        for j, m in enumerate(["movie1", "movie2", "movie3", "movie4", "movie5", "movie6", "movie7", "movie8"]):
+            print(f)
+            print(m)
+            tmp_df = pd.read_csv(os.path.join(r_path, f + m + '.csv'))
+            # Merging the values from the labels to match the node values from the results csv
+            merged_df = pd.merge(labels_df, tmp_df, left_on='one_based', right_on='Parcel')
+
+            # Specify the order of columns you want to retain
+            columns_order = ['Parcel', 'label', 'Yeo_7network', 
+                            'estimate', 'statistic', 'pval',
+                            'pvalFDR','pvalFWE']
+
+            # Reorder the DataFrame and drop any columns not listed
+            merged_df = merged_df[columns_order]
+            # Filter the DataFrame to only include significant results
+            filtered_df = merged_df[merged_df['pvalFWE'] < 0.05]
+            # Save the merged DataFrame to a new CSV file
+            filtered_df.to_csv(os.path.join(out_dir, f + m + '.csv'), index=False)
+    span.items = len(task_flist) * 8
+
+## summary of the time and memory used by every step
+tracer.summary()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+## this script runs the IS-RSA in Python (alternative to Movie_ISRSA_2024_07_01.R)
+## for each movie and parcel it fits the linear mixed models
+##   Distance ~ Features_Pre + Naming_Pre + Age + Sex + (1|Subject1) + (1|Subject2)
+##   Distance ~ Features_Post + Naming_Post + Age + Sex + (1|Subject1) + (1|Subject2)
+## with REML. The design is the same for all parcels, so it is set up once per model
+## and only the neural distances change between fits.
+## The results are written in the format of the R script (ISRSA_<effect>_<movie>.csv),
+## with parametric or permutation-based p-values.
+
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from movie_variability.isrsa import CrossedMixedModel, isrsa_table, permutation_isrsa, zscore
+from movie_variability.manifest import Manifest
+from movie_variability.pairs import PairIndex
+from movie_variability.pipeline import shard_values
+from movie_variability.store import MatrixStore, array_checksum
+from movie_variability.trace import Tracer
+
+## timing and memory of every step are appended to pipeline_logs/trace/run_isrsa[_<shard>].jsonl
+tracer = Tracer('run_isrsa')
+
+## location of main project directory on HPC
+proj_path = '/project/3011157.03/Simon/proj_2022_CABB_movie/'
+## location of the neural, behavioral and control matrices
+matrix_dir = os.path.join(proj_path, 'Scripts', '04_2ndLev_ISRSA', 'matrices')
+## where should the results be stored? (same location as the R output, for the visualization scripts)
+out_dir = os.path.join(proj_path, 'Scripts', '04_2ndLev_ISRSA', 'r_output')
+if not os.path.exists(out_dir):
+    os.makedirs(out_dir, exist_ok=True)
+    print('Directory %s created' % out_dir)
+n_jobs = 8 # number of worker processes fitting parcels in parallel
+## permutation inference: permute the subject labels of the behavioral matrices (Mantel-style)
+## and take the FWE-corrected p-values from the max-statistic distribution across parcels
+## (set to false for the parametric p-values of the R script)
+permutation = True
+n_permutations = 5000
+random_state = 2024 # the same permutations are used for all movies
+## movies whose neural distances, behavioral and control matrices and settings are unchanged
+## since the last run are skipped (recorded in one manifest per movie); set to false to refit all movies
+resume = True
+
+## load the pair index (the models use all ordered pairs)
+pair_index = PairIndex.load(os.path.join(proj_path, 'MRI', 'pair_index.npz'))
+## degrees of freedom of the p-values, as in the R script (number of unique pairs - fixed effects)
+df_resid = len(pair_index) - 5
+
+## get the values of all pairs from a behavioral or control matrix
+def pair_values(matrix_file):
+    matrix = pd.read_csv(os.path.join(matrix_dir, matrix_file), index_col = 0)
+    rows, cols = pair_index.indices(matrix.index, ordered = True)
+    return matrix.values[rows, cols].astype(float)
+
+## shared design of the pre and post models (predictors z-scored; Sex: 0 = same, 1 = different)
+intercept = np.ones(len(pair_index.full_rows))
+age = zscore(pair_values('Control_age.csv'))
+sex = pair_values('Control_sex.csv')
+## integer subject codes of the random effects
+subject1, subject2, _ = pair_index.pairs(ordered = True)
+covariates = np.column_stack([intercept, age, sex])
+models = {}
+behavior_matrices = {}
+for session in ['pre', 'post']:
+    features = zscore(pair_values('Features_%s.csv' % session))
+    naming = zscore(pair_values('Naming_%s.csv' % session))
+    models[session] = CrossedMixedModel(np.column_stack([intercept, features, naming, age, sex]), subject1, subject2)
+    behavior_matrices[session] = [pd.read_csv(os.path.join(matrix_dir, '%s_%s.csv' % (name, session)), index_col = 0)
+        for name in ['Features', 'Naming']]
+## effect -> (model, column of the fixed effect in the design)
+effects = {'features_pre': ('pre', 1), 'features_post': ('post', 1), 'naming_pre': ('pre', 2), 'naming_post': ('post', 2)}
+
+## fit the models of all parcels for each movie (of this shard when run as a sharded pipeline job)
+distance_store = MatrixStore(os.path.join(matrix_dir, 'distance_matrices'))
+rows, cols = pair_index.indices(distance_store.subjects, ordered = True)
+parcels = distance_store.coords['parcel']
+inputs = {name: os.path.join(matrix_dir, name + '.csv')
+    for name in ['Features_pre', 'Features_post', 'Naming_pre', 'Naming_post', 'Control_age', 'Control_sex']}
+inputs['pair_index'] = os.path.join(proj_path, 'MRI', 'pair_index.npz')
+for movie in shard_values('movie', distance_store.coords['movie']):
+    print(movie)
+    manifest = Manifest(os.path.join(out_dir, 'manifests', 'isrsa_%s.json' % movie))
+    params = {'distances': array_checksum(distance_store.get(movie = movie)), 'permutation': permutation,
+        'n_permutations': n_permutations, 'random_state': random_state}
+    if resume and manifest.is_current(movie, inputs, params):
+        print('%s: up to date' % movie)
+        continue
+    # neural distances of all pairs (pairs x parcels), z-scored per parcel
+    with tracer.span('load', movie = movie) as span:
+        distances = zscore(distance_store.get(movie = movie)[:, rows, cols].T)
+        span.items = distances.shape[1]
+    fits = {}
+    for session, model in models.items():
+        with tracer.span('compute', movie = movie, session = session) as span:
+            fits[session] = model.fit(distances, n_jobs = n_jobs)
+            span.items = distances.shape[1]
+    if permutation:
+        perm_results = {}
+        for session, model in models.items():
+            # behavioral matrices in one subject order, and the pair indices into them
+            subjects = behavior_matrices[session][0].index
+            predictors = np.array([matrix.loc[subjects, subjects].values for matrix in behavior_matrices[session]], dtype = float)
+            perm_rows, perm_cols = pair_index.indices(subjects, ordered = True)
+            with tracer.span('permutation', movie = movie, session = session) as span:
+                perm_results[session] = permutation_isrsa(model, distances, fits[session]['theta'], predictors, covariates,
+                    perm_rows, perm_cols, n_permutations = n_permutations, random_state = random_state, n_jobs = n_jobs)
+                span.items = n_permutations
+    for effect, (session, term) in effects.items():
+        if permutation:
+            # permutation_isrsa returns the tested predictors in design order (Features, Naming)
+            pval = perm_results[session]['p'][:, term - 1]
+            pval_fwe = perm_results[session]['p_fwe'][:, term - 1]
+            result_df = isrsa_table(fits[session], term, df_resid, parcels, pval = pval, pval_fwe = pval_fwe)
+        else:
+            result_df = isrsa_table(fits[session], term, df_resid, parcels)
+        with tracer.span('write', movie = movie, effect = effect) as span:
+            result_df.to_csv(os.path.join(out_dir, 'ISRSA_%s_%s.csv' % (effect, movie)), index = False)
+            span.items = len(result_df)
+    manifest.record(movie, inputs, params, outputs = [os.path.join(out_dir, 'ISRSA_%s_%s.csv' % (effect, movie)) for effect in effects])
+    manifest.save()
+
+## summary of the time and memory used by every step
+tracer.summary()
@@ -0,0 +1,5 @@
+### Submit script "XY.py" to HPC (Torque) cluster
+import subprocess
+
+subprocess.run(['echo "$PWD/run_isrsa.py" | qsub -l nodes=1:ppn=8,walltime=12:00:00,mem=16gb -N run_isrsa'], 
+    shell = True)
@@ -1,13 +1,16 @@
 #!/usr/bin/env python
 import os
+import sys
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
 
-from nltools.data import Brain_Data
-from nltools.mask import expand_mask, roi_to_brain
-from nltools.stats import threshold
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from movie_variability.atlas import Atlas
+from movie_variability.render import render_glass_brains
+from movie_variability.trace import Tracer
 
-from nilearn import plotting as nplot
+## timing and memory of every step are appended to pipeline_logs/trace/visualize_movie_ISRSA_results.jsonl
+tracer = Tracer('visualize_movie_ISRSA_results')
 
 ## location of main project directory on HPC
 proj_path = '/project/3011157.03/Simon/proj_2022_CABB_movie/'
@@ -20,6 +23,7 @@ if not os.path.exists(out_dir):
     print('Directory %s created' % out_dir)
 ## location of group mask
 mask_path = os.path.join(proj_path, 'MRI', 'groupmask_movies.nii.gz')
+n_jobs = 8 # number of worker processes rendering figures in parallel
 
 ## create a file list
 tmp_list = os.listdir(r_path)
@@ -35,31 +39,32 @@ task_flist = ['ISRSA_features_post_', 'ISRSA_features_pre_', 'ISRSA_naming_post_
 ## get brain parcellation (k = 210; Brainnetome)
 mask_name = 'Brainnetome'
 brainnetome_path = os.path.join(proj_path, 'MRI','Brainnetome_atlas', 'BN_Atlas_210_cortical_2mm.nii.gz')
-mask = Brain_Data(brainnetome_path, mask = mask_path)
-mask_x = expand_mask(mask)
+mask = Atlas.load(brainnetome_path, mask_path) # cached atlas restricted to the group mask
 
-## visualize betas and thresholded betas within glass brain and write niftis
-for i, f in enumerate(task_flist):
-    for j, m in enumerate(["movie1", "movie2", "movie3", "movie4", "movie5", "movie6", "movie7", "movie8"]):
-        print(f)
-        print(m)
-        tmp_df = pd.read_csv(os.path.join(r_path, f + m + '.csv'))
-        # beta_brain = roi_to_brain(pd.Series(tmp_df.loc[:, 'Beta']), mask_x)
-        beta_brain = roi_to_brain(pd.Series(tmp_df.loc[:, 'statistic']), mask_x)
-        pval_brain = roi_to_brain(pd.Series(tmp_df.loc[:, 'pvalFDR']), mask_x)
-        pval_fwe_brain = roi_to_brain(pd.Series(tmp_df.loc[:, 'pvalFWE']), mask_x)
+## read the results of all tasks and movies (maps x parcels)
+names = [f + m for f in task_flist for m in ["movie1", "movie2", "movie3", "movie4", "movie5", "movie6", "movie7", "movie8"]]
+with tracer.span('load') as span:
+    result_dfs = [pd.read_csv(os.path.join(r_path, name + '.csv')) for name in names]
+    span.items = len(result_dfs)
+# beta_values = np.array([tmp_df.loc[:, 'Beta'].values for tmp_df in result_dfs])
+beta_values = np.array([tmp_df.loc[:, 'statistic'].values for tmp_df in result_dfs])
+pval_fwe = np.array([tmp_df.loc[:, 'pvalFWE'].values for tmp_df in result_dfs])
+# threshold in parcel space (keep parcels with p < .05) before projecting to voxels
+beta_fwe = np.where(pval_fwe < 0.05, beta_values, 0)
 
-        ## plot and write unthreshoded image
-        # nplot.plot_glass_brain(beta_brain.to_nifti(),
-        #     colorbar = True, plot_abs = False, vmin = -0.10, vmax = 0.10, cmap = 'coolwarm')
-        # plt.savefig(os.path.join(out_dir, '%s%s.png' % (f, m))); plt.close()
-        # beta_brain.to_nifti().to_filename(os.path.join(out_dir, '%s%s.nii.gz' % (f, m)))
+## plot the thresholded images within glass brains (figures of unchanged results are skipped)
+with tracer.span('plot') as span:
+    rendered = render_glass_brains(mask, beta_fwe, [os.path.join(out_dir, '%s_pFWE005.png' % name) for name in names],
+        dict(colorbar = True, plot_abs = False, vmin = -6.00, vmax = 6.00, cmap = 'inferno'), dpi = 400, n_jobs = n_jobs)
+    span.items = len(rendered)
+print('%d of %d figures rendered' % (len(rendered), len(names)))
 
-        ## plot and write threshoded image
-        display = nplot.plot_glass_brain(threshold(beta_brain, pval_fwe_brain, thr=0.05).to_nifti(),
-            # colorbar = True, plot_abs = False, vmin = -0.10, vmax = 0.10, cmap = 'coolwarm',
-            colorbar = True, plot_abs = False, vmin = -6.00, vmax = 6.00, cmap = 'inferno')
-        # display.add_contours(threshold(beta_brain, pval_fwe_brain, thr=0.05).to_nifti(), colors = 'gray')
-        plt.savefig(os.path.join(out_dir, '%s%s_pFWE005.png' % (f, m)), dpi = 400); plt.close()
-        # threshold(beta_brain, pval_brain, thr=0.05).to_nifti().to_filename(os.path.join(out_dir, '%s%s_qFDR005.nii.gz' % (f, m)))
-        # threshold(beta_brain, pval_fwe_brain, thr=0.05).to_nifti().to_filename(os.path.join(out_dir, '%s%s_pFWE005.nii.gz' % (f, m)))
\ No newline at end of file
+## plot the unthresholded images
+# render_glass_brains(mask, beta_values, [os.path.join(out_dir, '%s.png' % name) for name in names],
+#     dict(colorbar = True, plot_abs = False, vmin = -0.10, vmax = 0.10, cmap = 'coolwarm'), n_jobs = n_jobs)
+## write niftis
+# for name, values in zip(names, beta_fwe):
+#     mask.to_nifti(values).to_filename(os.path.join(out_dir, '%s_pFWE005.nii.gz' % name))
+
+## summary of the time and memory used by every step
+tracer.summary()
@@ -0,0 +1,11 @@
+"""Shared computational core for the movie ISC and IS-RSA pipelines.
+
+The scripts in ``01_ISC`` and ``02_IS-RSA`` put the repository root on
+``sys.path`` and import the engines from here.
+
+Importing the core modules only loads NumPy (and the standard library).
+pandas, SciPy, pyarrow, nibabel and the plotting stack are imported inside
+the functions that need them, so array jobs that never plot or write
+tables do not pay for their import. The IS-RSA model (``isrsa``) is the
+exception; it needs SciPy's optimizer and linear algebra throughout.
+"""
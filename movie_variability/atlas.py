@@ -0,0 +1,111 @@
+"""Parcellation restricted to the group mask, cached on disk.
+
+Replaces the ``Brain_Data(atlas, mask=mask)`` / ``expand_mask`` /
+``roi_to_brain`` combination: averaging voxels into parcels is a single
+sparse matrix product and projecting parcel values back to voxels a single
+indexed lookup. The precomputed arrays are stored in a cache file keyed by a
+hash of the atlas and group mask files, so later stages skip the set-up.
+"""
+import os
+import hashlib
+
+import numpy as np
+
+
+def _file_hash(*paths):
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+class Atlas:
+    """Parcels of an atlas within a group mask.
+
+    ``voxels`` are the flat (C-order) indices of in-mask atlas voxels,
+    ``voxel_parcel`` the parcel (0-based, in order of ``labels``) of each of
+    them. Parcels are the sorted non-zero atlas labels, the order used by
+    ``Brain_Data.extract_roi`` and ``expand_mask``.
+    """
+
+    def __init__(self, shape, affine, voxels, voxel_parcel, labels):
+        self.shape = tuple(int(n) for n in shape)
+        self.affine = np.asarray(affine)
+        self.voxels = np.asarray(voxels)
+        self.voxel_parcel = np.asarray(voxel_parcel)
+        self.labels = np.asarray(labels)
+        self.counts = np.bincount(self.voxel_parcel, minlength=len(self.labels))
+        self._operator = None
+
+    @property
+    def operator(self):
+        """(parcels x voxels) sparse averaging operator, built on first use."""
+        if self._operator is None:
+            from scipy import sparse
+            self._operator = sparse.csr_matrix(
+                (1 / self.counts[self.voxel_parcel], (self.voxel_parcel, np.arange(len(self.voxels)))),
+                shape=(len(self.labels), len(self.voxels)))
+        return self._operator
+
+    @property
+    def n_parcels(self):
+        return len(self.labels)
+
+    @classmethod
+    def from_files(cls, atlas_path, mask_path):
+        import nibabel as nib
+
+        atlas_img = nib.load(atlas_path)
+        atlas = np.rint(np.asarray(atlas_img.dataobj)).astype(int)
+        mask = np.asarray(nib.load(mask_path).dataobj) > 0
+        if atlas.shape != mask.shape:
+            raise ValueError('Atlas %s and mask %s are on different grids (%s vs %s)'
+                % (atlas_path, mask_path, atlas.shape, mask.shape))
+        voxels = np.flatnonzero(mask & (atlas > 0))
+        labels, voxel_parcel = np.unique(atlas.ravel()[voxels], return_inverse=True)
+        return cls(atlas.shape, atlas_img.affine, voxels, voxel_parcel, labels)
+
+    @classmethod
+    def load(cls, atlas_path, mask_path, cache_dir=None):
+        """Load the atlas from cache, building and caching it on first use.
+
+        The cache file is keyed by the contents of both files and lives in
+        ``cache_dir`` (default: ``.atlas_cache`` next to the atlas).
+        """
+        if cache_dir is None:
+            cache_dir = os.path.join(os.path.dirname(os.path.abspath(atlas_path)), '.atlas_cache')
+        cache_file = os.path.join(cache_dir, 'atlas_%s.npz' % _file_hash(atlas_path, mask_path)[:16])
+        if os.path.exists(cache_file):
+            with np.load(cache_file) as cached:
+                return cls(**{key: cached[key] for key in cached.files})
+        atlas = cls.from_files(atlas_path, mask_path)
+        os.makedirs(cache_dir, exist_ok=True)
+        # write to a temporary file first, concurrent jobs may build the same cache
+        tmp_file = '%s.%d.tmp.npz' % (cache_file[:-4], os.getpid())
+        np.savez(tmp_file, shape=atlas.shape, affine=atlas.affine, voxels=atlas.voxels,
+            voxel_parcel=atlas.voxel_parcel, labels=atlas.labels)
+        os.replace(tmp_file, cache_file)
+        return atlas
+
+    def to_parcels(self, data):
+        """Average a (x, y, z, TRs) array within every parcel; returns (TRs, parcels)."""
+        vox = data.reshape(-1, data.shape[-1])[self.voxels]
+        return np.asarray(self.operator @ vox.astype(np.float64, copy=False)).T
+
+    def to_brain(self, values):
+        """Project parcel values (parcels,) or (maps, parcels) into (x, y, z) or (maps, x, y, z) volumes."""
+        values = np.asarray(values, dtype=float)
+        out = np.zeros(values.shape[:-1] + (int(np.prod(self.shape)),))
+        out[..., self.voxels] = values[..., self.voxel_parcel]
+        return out.reshape(values.shape[:-1] + self.shape)
+
+    def to_nifti(self, values):
+        """Parcel values as a NIfTI image, the equivalent of ``roi_to_brain(...).to_nifti()``."""
+        import nibabel as nib
+        return nib.Nifti1Image(self.to_brain(values), self.affine)
+
+    def label_image(self):
+        """The masked parcellation itself as a NIfTI image (for plotting)."""
+        return self.to_nifti(self.labels)
@@ -0,0 +1,220 @@
+"""Benchmarks of the pipeline stages on synthetic data.
+
+Every stage is timed on the synthetic inputs of ``movie_variability.synthetic``
+for each combination of a grid of subject counts, TR lengths and parcel
+counts. The data of a grid point is generated with a fixed seed, so runs at
+different commits time identical inputs. Each timing is the best of
+``--repeat`` runs after one untimed warm-up run; results are appended as JSON lines tagged with the git
+commit, host and library versions::
+
+    python -m movie_variability.benchmark --subjects 20 40 80 --trs 300 --parcels 210
+    python -m movie_variability.benchmark --compare pipeline_logs/benchmarks/<old>.jsonl pipeline_logs/benchmarks/<new>.jsonl
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import platform
+import itertools
+import subprocess
+import tempfile
+
+import numpy as np
+
+from . import synthetic
+from .isc import bootstrap_isc, chunked_isc, loo_inference, loo_isc, pairwise_distance, pairwise_isc
+from .isrsa import CrossedMixedModel, permutation_isrsa, zscore
+from .pairs import PairIndex
+from .pipeline import ROOT
+from .rdm import covariate_distances, session_matrices
+from .stats import rm_anova
+from .store import MatrixStore
+
+SEED = 2024
+
+
+class Inputs:
+    """Synthetic inputs of one grid point, generated on first use."""
+
+    def __init__(self, n_subjects, n_trs, n_parcels, n_bootstraps, n_permutations):
+        self.n_subjects = n_subjects
+        self.n_trs = n_trs
+        self.n_parcels = n_parcels
+        self.n_bootstraps = n_bootstraps
+        self.n_permutations = n_permutations
+        self.subjects = synthetic.subject_ids(n_subjects)
+        self._cache = {}
+
+    def _get(self, name, make):
+        if name not in self._cache:
+            self._cache[name] = make()
+        return self._cache[name]
+
+    def cube(self, movie=0):
+        return self._get(('cube', movie), lambda: synthetic.timeseries_cube(self.n_subjects, self.n_trs,
+            self.n_parcels, random_state=SEED + movie))
+
+    def isc(self, movie=0):
+        return self._get(('isc', movie), lambda: pairwise_isc(self.cube(movie)))
+
+    def pair_index(self):
+        return self._get('pair_index', lambda: PairIndex.from_real_pairs(synthetic.real_pair_ids(self.n_subjects)))
+
+    def rdm(self):
+        return self._get('rdm', lambda: synthetic.behavioral_rdm(self.n_subjects, random_state=SEED))
+
+    def covariates(self):
+        return self._get('covariates', lambda: synthetic.covariate_table(self.n_subjects, random_state=SEED))
+
+    def isrsa_model(self):
+        """The IS-RSA model (Features, Naming, Age, Sex), its behavioral matrices and covariates."""
+        def make():
+            pair_index = self.pair_index()
+            rows, cols = pair_index.indices(pair_index.subjects, ordered=True)
+            behavior = session_matrices(self.rdm(), self.n_subjects)
+            predictors = np.array([behavior[0], behavior[1]])
+            table = self.covariates()
+            age = zscore(covariate_distances(table['age'].values, 'absolute')[rows, cols])
+            sex = covariate_distances(table['sex_char'].values, 'mismatch')[rows, cols]
+            covariates = np.column_stack([np.ones(len(rows)), age, sex])
+            X = np.column_stack([covariates[:, :1], zscore(predictors[:, rows, cols].T), covariates[:, 1:]])
+            subject1, subject2, _ = pair_index.pairs(ordered=True)
+            distances = zscore(1 - self.isc()[:, rows, cols].T)
+            return CrossedMixedModel(X, subject1, subject2), distances, predictors, covariates, rows, cols
+        return self._get('isrsa_model', make)
+
+    def isrsa_theta(self):
+        return self._get('isrsa_theta', lambda: self.isrsa_model()[0].fit(self.isrsa_model()[1])['theta'])
+
+
+def _isc_anova(inputs):
+    rows, cols = inputs.pair_index().indices(inputs.pair_index().subjects, real_only=True)
+    rm_anova(np.stack([inputs.isc(movie)[:, rows, cols].T for movie in range(2)], axis=1))
+
+
+def _store(inputs):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        store = MatrixStore.create(os.path.join(tmp_dir, 'matrices'), {'movie': ['movie1'],
+            'parcel': list(range(inputs.n_parcels))}, inputs.subjects)
+        store.set(inputs.isc(), movie='movie1')
+        store.flush()
+        np.asarray(MatrixStore(os.path.join(tmp_dir, 'matrices')).get(movie='movie1')).sum()
+        del store
+
+
+def _isrsa_permutation(inputs):
+    model, distances, predictors, covariates, rows, cols = inputs.isrsa_model()
+    permutation_isrsa(model, distances, inputs.isrsa_theta(), predictors, covariates,
+        rows, cols, n_permutations=inputs.n_permutations, random_state=SEED)
+
+
+## stage name -> (function of the inputs, setup run untimed before it)
+STAGES = {
+    'isc': (lambda inputs: pairwise_isc(inputs.cube()), lambda inputs: inputs.cube()),
+    'bootstrap': (lambda inputs: bootstrap_isc(inputs.isc(), n_bootstraps=inputs.n_bootstraps, random_state=SEED),
+        lambda inputs: inputs.isc()),
+    'isc_low_memory': (lambda inputs: chunked_isc(inputs.cube(), n_bootstraps=inputs.n_bootstraps,
+        memory_limit=256 * 1024**2, random_state=SEED), lambda inputs: inputs.cube()),
+    'loo_isc': (lambda inputs: loo_inference(loo_isc(inputs.cube()), n_resamples=inputs.n_bootstraps, random_state=SEED),
+        lambda inputs: inputs.cube()),
+    'distance': (lambda inputs: pairwise_distance(inputs.cube()), lambda inputs: inputs.cube()),
+    'store': (_store, lambda inputs: inputs.isc()),
+    'pair_index': (lambda inputs: PairIndex.from_real_pairs(synthetic.real_pair_ids(inputs.n_subjects)), None),
+    'isc_anova': (_isc_anova, lambda inputs: [inputs.isc(movie) for movie in range(2)]),
+    'behavioral': (lambda inputs: session_matrices(inputs.rdm(), inputs.n_subjects), lambda inputs: inputs.rdm()),
+    'control': (lambda inputs: [covariate_distances(inputs.covariates()['age'].values, 'absolute'),
+        covariate_distances(inputs.covariates()['sex_char'].values, 'mismatch')], lambda inputs: inputs.covariates()),
+    'isrsa_fit': (lambda inputs: inputs.isrsa_model()[0].fit(inputs.isrsa_model()[1]), lambda inputs: inputs.isrsa_model()),
+    'isrsa_permutation': (_isrsa_permutation, lambda inputs: inputs.isrsa_theta()),
+}
+
+
+def environment():
+    """Commit, host and library versions the benchmark ran with."""
+    def git(*args):
+        try:
+            return subprocess.run(['git'] + list(args), cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+    return {'commit': git('rev-parse', 'HEAD'), 'dirty': bool(git('status', '--porcelain', '--untracked-files=no')),
+        'host': socket.gethostname(), 'cpus': os.cpu_count(), 'python': platform.python_version(),
+        'numpy': np.__version__, 'threads': {var: os.environ.get(var) for var in
+            ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS']}}
+
+
+def run(stages, subjects, trs, parcels, n_bootstraps=1000, n_permutations=100, repeat=3, out_path=None):
+    """Time ``stages`` at every grid point; returns the records (also appended to ``out_path``)."""
+    env = environment()
+    records = []
+    for n_subjects, n_trs, n_parcels in itertools.product(subjects, trs, parcels):
+        inputs = Inputs(n_subjects, n_trs, n_parcels, n_bootstraps, n_permutations)
+        for name in stages:
+            stage, setup = STAGES[name]
+            if setup is not None:
+                setup(inputs)
+            # warm-up run (lazy imports, caches, page faults of first allocations), not timed
+            stage(inputs)
+            times = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                stage(inputs)
+                times.append(time.perf_counter() - start)
+            record = dict(env, stage=name, n_subjects=n_subjects, n_trs=n_trs, n_parcels=n_parcels,
+                n_bootstraps=n_bootstraps, n_permutations=n_permutations, times_s=times, best_s=min(times))
+            records.append(record)
+            print('%-18s subjects=%-4d trs=%-5d parcels=%-4d %.4f s' % (name, n_subjects, n_trs, n_parcels, min(times)))
+            if out_path is not None:
+                with open(out_path, 'a') as f:
+                    f.write(json.dumps(record) + '\n')
+    return records
+
+
+def _key(record):
+    return (record['stage'], record['n_subjects'], record['n_trs'], record['n_parcels'],
+        record['n_bootstraps'], record['n_permutations'])
+
+
+def compare(base_path, new_path):
+    """Print the best times of two benchmark files side by side, for the grid points in both."""
+    results = []
+    for path in (base_path, new_path):
+        with open(path) as f:
+            # the last record of a grid point wins if a file holds several runs
+            records = [json.loads(line) for line in f if line.strip()]
+            results.append({_key(record): record['best_s'] for record in records})
+    base, new = results
+    print('%-18s %8s %6s %7s %10s %10s %8s' % ('stage', 'subjects', 'trs', 'parcels', 'base_s', 'new_s', 'speedup'))
+    for key in sorted(set(base) & set(new)):
+        print('%-18s %8d %6d %7d %10.4f %10.4f %7.2fx' % (key[:4] + (base[key], new[key], base[key] / new[key])))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline stages on synthetic data.')
+    parser.add_argument('--stages', nargs='+', choices=list(STAGES), default=list(STAGES))
+    parser.add_argument('--subjects', nargs='+', type=int, default=[20, 40])
+    parser.add_argument('--trs', nargs='+', type=int, default=[300])
+    parser.add_argument('--parcels', nargs='+', type=int, default=[50, 210])
+    parser.add_argument('--bootstraps', type=int, default=1000)
+    parser.add_argument('--permutations', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--out', default=None,
+        help='JSON lines file to append to (default: pipeline_logs/benchmarks/<commit>.jsonl)')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'), help='compare two benchmark files')
+    args = parser.parse_args(argv)
+    if args.compare:
+        compare(*args.compare)
+        return 0
+    out_path = args.out
+    if out_path is None:
+        out_dir = os.path.join(ROOT, 'pipeline_logs', 'benchmarks')
+        os.makedirs(out_dir, exist_ok=True)
+        out_path = os.path.join(out_dir, '%s.jsonl' % ((environment()['commit'] or 'unknown')[:10]))
+    run(args.stages, args.subjects, args.trs, args.parcels, args.bootstraps, args.permutations, args.repeat, out_path)
+    print('Results appended to %s' % out_path)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,76 @@
+"""Long-format pair datasets in a partitioned columnar (Parquet) layout.
+
+One export pass reads every movie's matrices once and writes all ordered
+pairs (the ``_full`` tables) with an ``is_upper`` flag marking the pairs of
+the upper-triangle list (the ``_upper`` tables). The dataset is partitioned
+hive-style as ``Movie=movie1/Parcel=parcel1/part-0.parquet``; Pair_Type and
+the subject columns are dictionary-encoded. Readers (``arrow::open_dataset``
+in R, ``load_pair_dataset`` here) filter on the partition columns and
+``is_upper`` without touching the other files.
+"""
+import os
+
+import numpy as np
+
+from .trace import span
+
+
+def export_pair_dataset(store, pair_index, dir_out, value_name, movies=None):
+    """Write the pairs of every matrix in ``store`` (dims movie, parcel) to a partitioned dataset.
+
+    ``pair_index`` is the ``PairIndex`` of the participants; all ordered pairs
+    are written, flagged with ``is_upper`` if they are upper-triangle pairs.
+    ``value_name`` names the value column (``'Correlation'`` or ``'Distance'``).
+    ``movies`` restricts the export to some of the movies (default: all).
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    rows, cols = pair_index.indices(store.subjects, ordered=True)
+    n_subs = len(pair_index.subjects)
+    is_upper = np.isin(pair_index.full_rows * n_subs + pair_index.full_cols,
+        pair_index.upper_rows * n_subs + pair_index.upper_cols)
+    # the pair columns are identical for every matrix, so encode them once
+    pairs_df = pair_index.frame(ordered=True)
+    pair_columns = {
+        'Pair_Type': pa.array(pairs_df['Pair_Type'].values).dictionary_encode(),
+        'Subject1': pa.array(pairs_df['Subject1'].values).dictionary_encode(),
+        'Subject2': pa.array(pairs_df['Subject2'].values).dictionary_encode(),
+        'is_upper': pa.array(is_upper),
+    }
+    for movie in (store.coords['movie'] if movies is None else movies):
+        # one read of all parcels of this movie (parcels x pairs)
+        with span('load', movie=movie) as current:
+            values = store.get(movie=movie)[:, rows, cols]
+            current.items = len(values)
+        with span('write', movie=movie) as current:
+            for i, parcel in enumerate(store.coords['parcel']):
+                dir_part = os.path.join(dir_out, 'Movie=%s' % movie, 'Parcel=parcel%s' % parcel)
+                os.makedirs(dir_part, exist_ok=True)
+                table = pa.table(dict(pair_columns, **{value_name: values[i]}))
+                pq.write_table(table, os.path.join(dir_part, 'part-0.parquet'))
+            current.items = len(values)
+
+
+def load_pair_dataset(dir_in, movies=None, parcels=None, pair_type=None, upper_only=False, columns=None):
+    """Load (part of) a pair dataset as a DataFrame, pushing the filters down to the scan.
+
+    ``movies`` and ``parcels`` are lists of partition values (e.g. ``['movie1']``,
+    ``['parcel5']``); ``pair_type`` selects ``'Real'`` or ``'Pseudo'`` pairs.
+    """
+    import pyarrow.dataset as ds
+
+    dataset = ds.dataset(dir_in, format='parquet', partitioning='hive')
+    conditions = []
+    if movies is not None:
+        conditions.append(ds.field('Movie').isin(list(movies)))
+    if parcels is not None:
+        conditions.append(ds.field('Parcel').isin(list(parcels)))
+    if pair_type is not None:
+        conditions.append(ds.field('Pair_Type') == pair_type)
+    if upper_only:
+        conditions.append(ds.field('is_upper'))
+    row_filter = None
+    for condition in conditions:
+        row_filter = condition if row_filter is None else row_filter & condition
+    return dataset.to_table(columns=columns, filter=row_filter).to_pandas()
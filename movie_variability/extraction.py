@@ -0,0 +1,52 @@
+"""Streaming parcel timeseries extraction.
+
+Instead of loading a whole 4D run into a ``Brain_Data`` object and calling
+``extract_roi``, runs are read in chunks of TRs and every chunk is reduced to
+parcel means with the sparse averaging operator of an ``Atlas``. Several
+atlases (a dict of ``Atlas`` objects keyed by atlas name) are served from the
+same read of each run. Subjects are spread over a process pool, so
+per-worker memory is bounded by the chunk size.
+"""
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+
+def extract_parcel_timeseries(img_path, atlases, chunk_size=50):
+    """Parcel-mean timeseries of one 4D run for every atlas, read ``chunk_size`` TRs at a time.
+
+    ``atlases`` maps atlas names to ``Atlas`` objects. Returns a dict
+    mapping each atlas name to an array of shape (TRs, parcels).
+    """
+    import nibabel as nib
+
+    # keep the (gzipped) file open so consecutive chunks continue decompression
+    # where the previous one stopped instead of starting over
+    img = nib.load(img_path, keep_file_open=True)
+    for name, atlas in atlases.items():
+        if img.shape[:3] != atlas.shape:
+            raise ValueError('%s is not on the grid of atlas %s (%s vs %s)'
+                % (img_path, name, img.shape[:3], atlas.shape))
+    n_ts = img.shape[3]
+    out = {name: np.empty((n_ts, atlas.n_parcels)) for name, atlas in atlases.items()}
+    for start in range(0, n_ts, chunk_size):
+        stop = min(start + chunk_size, n_ts)
+        chunk = np.asarray(img.dataobj[..., start:stop])
+        for name, atlas in atlases.items():
+            out[name][start:stop] = atlas.to_parcels(chunk)
+    return out
+
+
+def extract_cube(img_paths, atlases, chunk_size=50, n_jobs=1):
+    """Extract several runs (e.g. all subjects of one movie) into one (runs x TRs x parcels) cube per atlas.
+
+    Returns a dict keyed like ``atlases``. With ``n_jobs > 1`` the runs are
+    processed in a pool of worker processes.
+    """
+    if n_jobs == 1:
+        timeseries = [extract_parcel_timeseries(path, atlases, chunk_size) for path in img_paths]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            timeseries = list(pool.map(extract_parcel_timeseries, img_paths,
+                [atlases] * len(img_paths), [chunk_size] * len(img_paths)))
+    return {name: np.array([run[name] for run in timeseries]) for name in atlases}
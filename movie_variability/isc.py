@@ -0,0 +1,254 @@
+"""Batched inter-subject correlation engines.
+
+All functions operate on the (subjects x TRs x parcels) arrays produced by
+``extract_timeseries.py`` and handle every parcel at once.
+"""
+import numpy as np
+
+from .stats import fdr_correction
+from .trace import span
+
+
+def standardize_timeseries(data, dtype=np.float64):
+    """Center and scale every subject's parcel time series to unit norm.
+
+    Returns an array of shape (parcels, subjects, TRs) whose inner products
+    along the last axis are Pearson correlations.
+    """
+    ts = np.moveaxis(np.asarray(data, dtype=dtype), 2, 0).copy()
+    ts -= ts.mean(axis=2, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ts /= np.linalg.norm(ts, axis=2, keepdims=True)
+    return ts
+
+
+def isc_from_standardized(ts):
+    """Subject x subject correlation matrices from ``standardize_timeseries`` output."""
+    isc = np.matmul(ts, ts.transpose(0, 2, 1))
+    np.clip(isc, -1, 1, out=isc)
+    diag = np.arange(isc.shape[1])
+    isc[:, diag, diag] = 1
+    return isc
+
+
+def pairwise_isc(data, dtype=np.float64):
+    """Subject x subject correlation matrices for all parcels.
+
+    Equivalent to ``1 - pairwise_distances(data[:, :, p], metric='correlation')``
+    for every parcel ``p``, computed with one batched matrix multiply.
+    Returns an array of shape (parcels, subjects, subjects).
+    """
+    return isc_from_standardized(standardize_timeseries(data, dtype))
+
+
+def update_isc(isc_matrices, ts_old, ts_new):
+    """Extend existing ISC matrices with new subjects.
+
+    ``isc_matrices`` (parcels x n_old x n_old) were computed from the
+    standardized timeseries ``ts_old``; ``ts_new`` holds the standardized
+    timeseries of the added subjects (parcels x n_new x TRs). Only the new
+    rows and columns are computed. Returns (parcels x n_old + n_new x n_old + n_new)
+    matrices with the new subjects appended last.
+    """
+    n_parcels, n_old = ts_old.shape[:2]
+    n_all = n_old + ts_new.shape[1]
+    block = np.matmul(ts_new, np.concatenate([ts_old, ts_new], axis=1).transpose(0, 2, 1))
+    np.clip(block, -1, 1, out=block)
+    isc = np.empty((n_parcels, n_all, n_all), dtype=block.dtype)
+    isc[:, :n_old, :n_old] = isc_matrices
+    isc[:, n_old:, :] = block
+    isc[:, :, n_old:] = block.transpose(0, 2, 1)
+    diag = np.arange(n_old, n_all)
+    isc[:, diag, diag] = 1
+    return isc
+
+
+def pairwise_distance(data, dtype=np.float64):
+    """Correlation distance (1 - r) matrices for all parcels, see ``pairwise_isc``."""
+    return 1 - pairwise_isc(data, dtype)
+
+
+def _mean_isc(z, counts):
+    """Fisher-z averaged ISC of resampled matrices.
+
+    ``z`` holds Fisher-z matrices with a zero diagonal (parcels x subjects x
+    subjects) and ``counts`` how often each subject was drawn per bootstrap
+    (bootstraps x subjects). Pairs of identical subjects are excluded, as in
+    the nltools bootstrap.
+    """
+    counts = counts.astype(z.dtype)
+    total = np.einsum('psb,bs->pb', np.matmul(z, counts.T), counts)
+    n_pairs = counts.sum(axis=1) ** 2 - (counts ** 2).sum(axis=1)
+    return np.tanh(total / n_pairs)
+
+
+def _bootstrap_samples(n_subs, n_bootstraps, random_state=None):
+    """Subject indices of every bootstrap resample (bootstraps x subjects)."""
+    rng = np.random.default_rng(random_state)
+    return rng.integers(0, n_subs, size=(n_bootstraps, n_subs))
+
+
+def _bootstrap_parcels(isc_matrices, samples, ci_percentile=95, chunk_size=500, dtype=np.float64):
+    """Mean ISC, confidence interval and uncorrected p-value of every parcel in ``isc_matrices``."""
+    n_subs = isc_matrices.shape[1]
+    n_bootstraps = len(samples)
+    diag = np.arange(n_subs)
+    z = np.array(isc_matrices, dtype=dtype)
+    z[:, diag, diag] = 0
+    z = np.arctanh(z)
+
+    observed = _mean_isc(z, np.ones((1, n_subs), dtype=int))[:, 0]
+    boot = np.empty((len(z), n_bootstraps), dtype=dtype)
+    for start in range(0, n_bootstraps, chunk_size):
+        chunk = samples[start:start + chunk_size]
+        offsets = n_subs * np.arange(len(chunk))[:, None]
+        counts = np.bincount((chunk + offsets).ravel(), minlength=chunk.size).reshape(chunk.shape)
+        boot[:, start:start + len(chunk)] = _mean_isc(z, counts)
+
+    null = boot - observed[:, None]
+    p = (np.sum(np.abs(null) >= np.abs(observed)[:, None], axis=1) + 1) / (n_bootstraps + 1)
+    tail = (100 - ci_percentile) / 2
+    return {
+        'isc': observed,
+        'ci_lower': np.percentile(boot, tail, axis=1),
+        'ci_upper': np.percentile(boot, 100 - tail, axis=1),
+        'p': p,
+    }
+
+
+def _corrected(stats):
+    """Add Bonferroni (``p_fwe``) and Benjamini-Hochberg (``p_fdr``) corrected p-values across parcels."""
+    stats['p_fwe'] = stats['p'] * len(stats['p'])
+    stats['p_fdr'] = fdr_correction(stats['p'])
+    return stats
+
+
+def bootstrap_isc(isc_matrices, n_bootstraps=10000, ci_percentile=95, chunk_size=500, random_state=None):
+    """Subject-wise bootstrap of the mean ISC for all parcels at once.
+
+    Follows the nltools ``Adjacency.isc(metric='mean')`` procedure (Chen et al.,
+    2016): subjects are resampled with replacement, self-pairs are dropped and
+    the Fisher-z mean is compared against the bootstrap distribution shifted to
+    zero. The resampling indices are drawn once and shared by all parcels;
+    bootstraps are evaluated in chunks of ``chunk_size`` to cap memory.
+
+    Returns a dict of per-parcel arrays: ``isc``, ``ci_lower``, ``ci_upper``,
+    ``p``, ``p_fwe`` (Bonferroni) and ``p_fdr`` (Benjamini-Hochberg).
+    """
+    isc_matrices = np.asarray(isc_matrices)
+    samples = _bootstrap_samples(isc_matrices.shape[1], n_bootstraps, random_state)
+    return _corrected(_bootstrap_parcels(isc_matrices, samples, ci_percentile, chunk_size))
+
+
+def parcel_chunk_size(n_subs, n_ts, n_bootstraps, memory_limit, dtype=np.float32, chunk_size=500):
+    """Number of parcels whose ISC matrices and bootstrap fit into ``memory_limit`` bytes.
+
+    Counts the working arrays of one parcel in ``chunked_isc``: two copies of
+    its time series, its ISC and Fisher-z matrices, one chunk of resampled
+    sums and three copies of its bootstrap distribution.
+    """
+    itemsize = np.dtype(dtype).itemsize
+    per_parcel = itemsize * (2 * n_subs * n_ts + 2 * n_subs ** 2 + n_subs * chunk_size + 3 * n_bootstraps)
+    return max(1, int(memory_limit // per_parcel))
+
+
+def chunked_isc(data, out=None, ts_out=None, n_bootstraps=10000, memory_limit=2 * 1024 ** 3, dtype=np.float32,
+                ci_percentile=95, chunk_size=500, random_state=None, labels=None):
+    """ISC matrices and bootstrap statistics of all parcels, computed a bounded chunk of parcels at a time.
+
+    Low-memory counterpart of ``pairwise_isc`` followed by ``bootstrap_isc``:
+    ``data`` (subjects x TRs x parcels, e.g. a memory-mapped cube) is read a
+    chunk of parcels at a time and all arrays are kept in ``dtype``. The
+    chunk size is chosen with ``parcel_chunk_size`` so that the working
+    arrays stay below ``memory_limit`` bytes. The ISC matrices are written to
+    ``out`` (parcels x subjects x subjects) and the standardized time series
+    to ``ts_out`` (parcels x subjects x TRs) if given, e.g. memory-mapped
+    arrays (flushed after every chunk). All chunks share the same bootstrap
+    resamples. Every chunk is traced as ``compute``, ``write`` and
+    ``bootstrap`` spans with ``labels`` and its parcel range.
+
+    Returns the same dict as ``bootstrap_isc``.
+    """
+    n_subs, n_ts, n_parcels = data.shape
+    samples = _bootstrap_samples(n_subs, n_bootstraps, random_state)
+    step = parcel_chunk_size(n_subs, n_ts, n_bootstraps, memory_limit, dtype, chunk_size)
+    stats = []
+    for start in range(0, n_parcels, step):
+        chunk_labels = dict(labels or {}, start=start, stop=min(start + step, n_parcels))
+        with span('compute', **chunk_labels) as current:
+            ts = standardize_timeseries(data[:, :, start:start + step], dtype)
+            isc = isc_from_standardized(ts)
+            current.items = len(isc)
+        with span('write', **chunk_labels) as current:
+            for array, values in [(ts_out, ts), (out, isc)]:
+                if array is not None:
+                    array[start:start + step] = values
+                    if hasattr(array, 'flush'):
+                        array.flush()
+            current.items = len(isc)
+        del ts
+        with span('bootstrap', **chunk_labels) as current:
+            stats.append(_bootstrap_parcels(isc, samples, ci_percentile, chunk_size, dtype))
+            current.items = len(isc)
+        del isc
+    return _corrected({key: np.concatenate([chunk[key] for chunk in stats]) for key in stats[0]})
+
+
+def loo_isc(data, dtype=np.float64):
+    """Leave-one-out ISC: correlation of every subject with the mean time series of all others.
+
+    ``data`` is (subjects x TRs x parcels). With the centered time series
+    ``c_i`` and their sum ``S``, the others' mean is proportional to
+    ``S - c_i``, so every subject's correlation follows from ``c_i . S`` and
+    the norms of ``c_i`` and ``S``: one pass over the data instead of one
+    mean per subject. Returns an array (parcels x subjects), NaN for
+    constant time series.
+    """
+    ts = np.moveaxis(np.asarray(data, dtype=dtype), 2, 0).copy()
+    ts -= ts.mean(axis=2, keepdims=True)
+    total = ts.sum(axis=1)
+    dot = np.einsum('pst,pt->ps', ts, total)
+    norm2 = np.einsum('pst,pst->ps', ts, ts)
+    total2 = np.einsum('pt,pt->p', total, total)[:, None]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        isc = (dot - norm2) / np.sqrt(norm2 * (total2 - 2 * dot + norm2))
+    return np.clip(isc, -1, 1)
+
+
+def loo_inference(loo, method='bootstrap', n_resamples=10000, ci_percentile=95, chunk_size=500, random_state=None):
+    """Group-level test of leave-one-out ISC values (parcels x subjects) for all parcels at once.
+
+    The summary is the Fisher-z mean over subjects. ``method='bootstrap'``
+    resamples subjects with replacement and compares the summary against
+    the bootstrap distribution shifted to zero, as ``bootstrap_isc`` does
+    for the pairwise ISC; ``method='permutation'`` flips the signs of the
+    subjects' Fisher-z values. Resamples are shared by all parcels.
+
+    Returns the dict of ``bootstrap_isc`` (``isc``, ``ci_lower``,
+    ``ci_upper``, ``p``, ``p_fwe``, ``p_fdr``); the confidence interval is
+    NaN for the permutation test.
+    """
+    if method not in ('bootstrap', 'permutation'):
+        raise ValueError("Unknown method %r, expected 'bootstrap' or 'permutation'" % method)
+    z = np.arctanh(np.asarray(loo, dtype=np.float64))
+    n_parcels, n_subs = z.shape
+    observed = np.tanh(z.mean(axis=1))
+    rng = np.random.default_rng(random_state)
+    null = np.empty((n_parcels, n_resamples))
+    for start in range(0, n_resamples, chunk_size):
+        n_chunk = min(chunk_size, n_resamples - start)
+        if method == 'bootstrap':
+            samples = rng.integers(0, n_subs, size=(n_chunk, n_subs))
+            offsets = n_subs * np.arange(n_chunk)[:, None]
+            weights = np.bincount((samples + offsets).ravel(), minlength=samples.size).reshape(samples.shape)
+        else:
+            weights = rng.choice([-1, 1], size=(n_chunk, n_subs))
+        null[:, start:start + n_chunk] = np.tanh(z @ weights.T / n_subs)
+    if method == 'bootstrap':
+        tail = (100 - ci_percentile) / 2
+        ci_lower, ci_upper = np.percentile(null, tail, axis=1), np.percentile(null, 100 - tail, axis=1)
+        null -= observed[:, None]
+    else:
+        ci_lower = ci_upper = np.full(n_parcels, np.nan)
+    p = (np.sum(np.abs(null) >= np.abs(observed)[:, None], axis=1) + 1) / (n_resamples + 1)
+    return _corrected({'isc': observed, 'ci_lower': ci_lower, 'ci_upper': ci_upper, 'p': p})
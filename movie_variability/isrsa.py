@@ -0,0 +1,198 @@
+"""Batched IS-RSA with crossed random-effects linear mixed models.
+
+Every IS-RSA model has the same form,
+``Distance ~ predictors + (1|Subject1) + (1|Subject2)``, and the same design
+for all parcels of a movie; only the neural response changes. The model is
+fitted by REML with lme4's profiled deviance: the cross-products Z'Z, Z'X
+and X'X are computed once and every deviance evaluation only needs a
+Cholesky factorization of the (levels x levels) random-effects system, so a
+parcel costs a few small factorizations instead of a full refit.
+"""
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy import sparse
+from scipy.linalg import solve_triangular
+from scipy.optimize import minimize
+
+from .stats import fdr_correction
+
+
+def zscore(values, axis=0):
+    """Center and scale to unit (n - 1) standard deviation, like R's ``scale``."""
+    values = np.asarray(values, dtype=float)
+    return (values - values.mean(axis=axis, keepdims=True)) / values.std(axis=axis, ddof=1, keepdims=True)
+
+
+class CrossedMixedModel:
+    """REML fits of ``y ~ X + (1|groups1) + (1|groups2)`` for many responses sharing X and the groups."""
+
+    def __init__(self, X, groups1, groups2):
+        X = np.asarray(X, dtype=float)
+        self.n_obs, self.n_fixed = X.shape
+        codes = [np.unique(np.asarray(groups), return_inverse=True)[1] for groups in (groups1, groups2)]
+        self.n_levels = [codes[0].max() + 1, codes[1].max() + 1]
+        n_q = sum(self.n_levels)
+        # sparse (observations x levels) random-effects design of both factors
+        self.Z = sparse.csr_matrix((np.ones(2 * self.n_obs),
+            (np.tile(np.arange(self.n_obs), 2), np.concatenate([codes[0], codes[1] + self.n_levels[0]]))),
+            shape=(self.n_obs, n_q))
+        self.X = X
+        self.ztz = (self.Z.T @ self.Z).toarray()
+        self.ztx = np.asarray(self.Z.T @ X)
+        self.xtx = X.T @ X
+        self.df_reml = self.n_obs - self.n_fixed
+
+    def _factorize(self, theta, zty, xty, yty):
+        lam = np.repeat(theta, self.n_levels)
+        A = lam[:, None] * self.ztz * lam[None, :]
+        A[np.diag_indices_from(A)] += 1
+        L = np.linalg.cholesky(A)
+        cu = solve_triangular(L, lam * zty, lower=True)
+        rzx = solve_triangular(L, lam[:, None] * self.ztx, lower=True)
+        rx = np.linalg.cholesky(self.xtx - rzx.T @ rzx)
+        cb = solve_triangular(rx, xty - rzx.T @ cu, lower=True)
+        r2 = yty - cu @ cu - cb @ cb
+        return L, rx, cb, r2
+
+    def deviance(self, theta, zty, xty, yty):
+        """Profiled REML deviance for relative random-effect standard deviations ``theta``."""
+        L, rx, cb, r2 = self._factorize(theta, zty, xty, yty)
+        return (2 * np.log(np.diag(L)).sum() + 2 * np.log(np.diag(rx)).sum()
+            + self.df_reml * (1 + np.log(2 * np.pi * r2 / self.df_reml)))
+
+    def _fit_one(self, zty, xty, yty, theta0):
+        res = minimize(self.deviance, theta0, args=(zty, xty, yty), method='Nelder-Mead',
+            bounds=[(0, None), (0, None)], options={'xatol': 1e-6, 'fatol': 1e-8})
+        theta = res.x
+        L, rx, cb, r2 = self._factorize(theta, zty, xty, yty)
+        sigma2 = r2 / self.df_reml
+        beta = solve_triangular(rx.T, cb, lower=False)
+        rx_inv = solve_triangular(rx, np.eye(self.n_fixed), lower=True)
+        se = np.sqrt(sigma2 * np.sum(rx_inv ** 2, axis=0))
+        return beta, se, theta, sigma2
+
+    def _fit_block(self, zty, xty, yty, theta0):
+        return [self._fit_one(zty[:, j], xty[:, j], yty[j], theta0) for j in range(len(yty))]
+
+    def fit(self, Y, theta0=(1.0, 1.0), n_jobs=1):
+        """Fit one model per column of ``Y`` (observations x responses).
+
+        Returns a dict of arrays: ``estimate``, ``se`` and ``statistic``
+        (responses x fixed effects), ``theta`` (responses x 2) and ``sigma``.
+        """
+        Y = np.asarray(Y, dtype=float).reshape(self.n_obs, -1)
+        zty = np.asarray(self.Z.T @ Y)
+        xty = self.X.T @ Y
+        yty = np.einsum('ij,ij->j', Y, Y)
+        theta0 = np.asarray(theta0, dtype=float)
+        if n_jobs == 1:
+            fits = self._fit_block(zty, xty, yty, theta0)
+        else:
+            blocks = np.array_split(np.arange(Y.shape[1]), n_jobs)
+            with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+                futures = [pool.submit(self._fit_block, zty[:, b], xty[:, b], yty[b], theta0) for b in blocks]
+                fits = [fit for future in futures for fit in future.result()]
+        beta, se, theta, sigma2 = (np.array(values) for values in zip(*fits))
+        return {'estimate': beta, 'se': se, 'statistic': beta / se, 'theta': theta, 'sigma': np.sqrt(sigma2)}
+
+
+class _GLSFactors:
+    """Per-response pieces of a fit with theta held fixed that do not depend on the design.
+
+    With the variance components fixed the model is a generalized least
+    squares fit, so the random-effects factorization is shared by any design
+    and all responses are solved in batch.
+    """
+
+    def __init__(self, model, Y, theta):
+        self.model = model
+        self.Y = np.asarray(Y, dtype=float).reshape(model.n_obs, -1)
+        self.lam = np.repeat(np.asarray(theta, dtype=float), model.n_levels, axis=1)
+        A = self.lam[:, :, None] * model.ztz * self.lam[:, None, :]
+        A += np.eye(A.shape[1])
+        self.L_inv = np.linalg.inv(np.linalg.cholesky(A))
+        self.cu = np.einsum('rij,rj->ri', self.L_inv, self.lam * np.asarray(model.Z.T @ self.Y).T)
+        self.yty = np.einsum('ij,ij->j', self.Y, self.Y)
+
+    def statistic(self, X):
+        n_obs, n_fixed = X.shape
+        rzx = self.L_inv @ (self.lam[:, :, None] * np.asarray(self.model.Z.T @ X))
+        rx = np.linalg.cholesky(X.T @ X - np.swapaxes(rzx, 1, 2) @ rzx)
+        rx_inv = np.linalg.inv(rx)
+        cb = np.einsum('rij,rj->ri', rx_inv, (X.T @ self.Y).T - np.einsum('rqp,rq->rp', rzx, self.cu))
+        sigma2 = (self.yty - (self.cu ** 2).sum(axis=1) - (cb ** 2).sum(axis=1)) / (n_obs - n_fixed)
+        beta = np.einsum('rji,rj->ri', rx_inv, cb)
+        se = np.sqrt(sigma2[:, None] * (rx_inv ** 2).sum(axis=1))
+        return beta / se
+
+
+def _permuted_design(predictors, covariates, rows, cols, perm):
+    return np.column_stack([zscore(predictors[:, perm[rows], perm[cols]].T), covariates])
+
+
+def _permutation_block(model, Y, theta, predictors, covariates, rows, cols, perms):
+    factors = _GLSFactors(model, Y, theta)
+    n_tested = len(predictors)
+    return np.array([factors.statistic(_permuted_design(predictors, covariates, rows, cols, perm))[:, :n_tested]
+        for perm in perms])
+
+
+def permutation_isrsa(model, Y, theta, predictors, covariates, rows, cols, n_permutations=5000,
+                      random_state=None, n_jobs=1):
+    """Mantel-style permutation test of the behavioral predictors of an IS-RSA model.
+
+    ``predictors`` are (k x subjects x subjects) behavioral matrices, gathered
+    into pair values with ``rows``/``cols`` (the pair indices of the model's
+    observations) and z-scored; ``covariates`` (observations x m) are the
+    remaining, unpermuted columns of the design (intercept, Age, Sex). Each
+    permutation relabels the subjects of all behavioral matrices at once,
+    which keeps the pair structure exchangeable, and recomputes the t
+    statistic of every response (parcel). The variance components are held
+    at the observed REML estimates ``theta`` (``fit['theta']``) so a
+    permutation is a batched GLS solve instead of a refit.
+
+    Returns a dict with ``statistic`` (responses x k, observed), ``p`` (one-sided,
+    per response), ``p_fwe`` (from the distribution of the maximum statistic
+    across responses) and ``null_max`` (permutations x k). Use the same
+    ``random_state`` for several calls to apply identical permutations.
+    """
+    predictors = np.asarray(predictors, dtype=float)
+    Y = np.asarray(Y, dtype=float).reshape(model.n_obs, -1)
+    rng = np.random.default_rng(random_state)
+    n_subs = predictors.shape[1]
+    perms = [rng.permutation(n_subs) for _ in range(n_permutations)]
+    observed = _permutation_block(model, Y, theta, predictors, covariates, rows, cols, [np.arange(n_subs)])[0]
+    if n_jobs == 1:
+        null = _permutation_block(model, Y, theta, predictors, covariates, rows, cols, perms)
+    else:
+        blocks = [list(block) for block in np.array_split(np.arange(n_permutations), n_jobs)]
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            futures = [pool.submit(_permutation_block, model, Y, theta, predictors, covariates, rows, cols,
+                [perms[i] for i in block]) for block in blocks]
+            null = np.concatenate([future.result() for future in futures])
+    null_max = null.max(axis=1)
+    p = ((null >= observed).sum(axis=0) + 1) / (n_permutations + 1)
+    p_fwe = ((null_max[:, None, :] >= observed).sum(axis=0) + 1) / (n_permutations + 1)
+    return {'statistic': observed, 'p': p, 'p_fwe': p_fwe, 'null_max': null_max}
+
+
+def isrsa_table(fit, term_index, df, parcels, pval=None, pval_fwe=None):
+    """Per-parcel result table of one fixed effect, in the format of ``Movie_ISRSA_2024_07_01.R``.
+
+    p-values are one-sided (positive association) from the t distribution
+    with ``df`` degrees of freedom; pvalFDR and pvalFWE (Bonferroni) are
+    adjusted across parcels. Permutation p-values (``pval``, and the
+    max-statistic ``pval_fwe``) replace the parametric ones when given.
+    """
+    import pandas as pd
+    from scipy import stats
+
+    statistic = fit['statistic'][:, term_index]
+    if pval is None:
+        pval = stats.t.sf(statistic, df)
+    if pval_fwe is None:
+        pval_fwe = np.minimum(pval * len(pval), 1)
+    return pd.DataFrame({'Parcel': parcels, 'estimate': fit['estimate'][:, term_index],
+        'statistic': statistic, 'pval': pval, 'pvalFDR': fdr_correction(pval),
+        'pvalFWE': pval_fwe})
@@ -0,0 +1,79 @@
+"""Manifests of completed work units, for skipping unchanged work and resuming after a crash.
+
+A stage records every unit it finished (a movie, or a subject of a movie)
+with the content hashes of its input files, its parameters and the hashes of
+the output files it wrote. Outputs written into a file shared by several
+units (e.g. one movie of a ``MatrixStore``) are recorded by the checksum of
+their array slice instead. On a rerun a unit is skipped if all of these
+still match. Hashes of unchanged files (same size and modification time)
+are taken from the manifest instead of reading the file again.
+"""
+import os
+import json
+import hashlib
+
+from .store import array_checksum
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 24), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class Manifest:
+    """JSON manifest of the units of one stage (or shard of a stage) at ``path``."""
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.units = {}
+        self.files = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                content = json.load(f)
+            self.units = content['units']
+            self.files = content['files']
+
+    def file_hash(self, path):
+        """SHA-256 of a file, re-read only if its size or modification time changed."""
+        path = os.path.abspath(str(path))
+        stat = os.stat(path)
+        known = self.files.get(path)
+        if known is None or known[:2] != [stat.st_size, stat.st_mtime_ns]:
+            known = [stat.st_size, stat.st_mtime_ns, _sha256(path)]
+            self.files[path] = known
+        return known[2]
+
+    def _hashes(self, paths):
+        return {name: self.file_hash(path) for name, path in paths.items()}
+
+    def is_current(self, unit, inputs, params=None, arrays=None):
+        """Whether ``unit`` was recorded with the same inputs (name -> path) and parameters,
+        and its outputs (files and arrays, name -> array) are unchanged."""
+        entry = self.units.get(unit)
+        if entry is None or entry['params'] != json.loads(json.dumps(params)):
+            return False
+        try:
+            return (entry['inputs'] == self._hashes(inputs)
+                and all(self.file_hash(path) == digest for path, digest in entry['outputs'].items())
+                and entry.get('arrays', {}) == {name: array_checksum(data) for name, data in (arrays or {}).items()})
+        except FileNotFoundError:
+            return False
+
+    def record(self, unit, inputs, params=None, outputs=(), arrays=None):
+        """Record a finished unit; call ``save`` to write the manifest."""
+        self.units[unit] = {'inputs': self._hashes(inputs), 'params': json.loads(json.dumps(params)),
+            'outputs': {os.path.abspath(str(path)): self.file_hash(path) for path in outputs},
+            'arrays': {name: array_checksum(data) for name, data in (arrays or {}).items()}}
+
+    def clear(self):
+        self.units = {}
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'units': self.units, 'files': self.files}, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
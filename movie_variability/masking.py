@@ -0,0 +1,75 @@
+"""Group brain mask from the fMRIPrep masks of all subjects.
+
+Mask files are found by their fMRIPrep file names instead of indexing the
+whole BIDS tree, and the group mask is computed like nilearn's
+``intersect_masks``: a voxel is kept if it is in more than ``threshold`` of
+the subject masks, followed by the largest connected component. The votes
+are summed one mask at a time, with chunks of subjects counted in parallel,
+so memory does not grow with the number of subjects.
+"""
+import os
+import glob
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+
+def find_brain_masks(derivatives_dir, subjects, space='MNI152NLin2009cAsym'):
+    """Path of the functional brain mask of every subject (the first match per subject, in sorted order)."""
+    mask_paths = []
+    for subj in subjects:
+        name = 'sub-%s_*space-%s_desc-brain_mask.nii.gz' % (subj, space)
+        matches = sorted(glob.glob(os.path.join(derivatives_dir, '*', 'sub-%s' % subj, 'func', name))
+            + glob.glob(os.path.join(derivatives_dir, '*', 'sub-%s' % subj, 'ses-*', 'func', name)))
+        if not matches:
+            raise FileNotFoundError('No %s brain mask found for subject %s in %s' % (space, subj, derivatives_dir))
+        mask_paths.append(matches[0])
+    return mask_paths
+
+
+def _count_masks(mask_paths):
+    import nibabel as nib
+
+    counts, affine = None, None
+    for path in mask_paths:
+        img = nib.load(path)
+        mask = np.asarray(img.dataobj) != 0
+        if counts is None:
+            counts, affine = np.zeros(mask.shape, dtype=np.int32), img.affine
+        elif mask.shape != counts.shape or not np.allclose(img.affine, affine):
+            raise ValueError('Mask %s is not on the grid of %s' % (path, mask_paths[0]))
+        counts += mask
+    return counts, affine
+
+
+def group_mask(mask_paths, threshold=0.8, connected=True, n_jobs=1):
+    """Voxels in more than ``threshold`` (fraction) of the masks, as a NIfTI image.
+
+    Gives the mask of ``nilearn.masking.intersect_masks``: ``threshold=1``
+    is the intersection and ``threshold=0`` the union of the masks. With
+    ``connected`` only the largest connected component is kept.
+    """
+    import nibabel as nib
+    from scipy import ndimage
+
+    if not 0 <= threshold <= 1:
+        raise ValueError('threshold should be between 0 and 1, got %s' % threshold)
+    # as in nilearn, so that threshold=1 keeps the voxels of all masks
+    threshold = min(threshold, 1 - 1e-7)
+    mask_paths = [str(path) for path in mask_paths]
+    if n_jobs == 1:
+        parts = [_count_masks(mask_paths)]
+    else:
+        chunks = [list(chunk) for chunk in np.array_split(mask_paths, n_jobs) if len(chunk)]
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            parts = list(pool.map(_count_masks, chunks))
+    counts, affine = parts[0]
+    for part_counts, part_affine in parts[1:]:
+        if part_counts.shape != counts.shape or not np.allclose(part_affine, affine):
+            raise ValueError('Masks are not all on the same grid')
+        counts = counts + part_counts
+    mask = counts > threshold * len(mask_paths)
+    if connected and mask.any():
+        labels, n_labels = ndimage.label(mask)
+        mask = labels == np.argmax(np.bincount(labels.ravel())[1:]) + 1
+    return nib.Nifti1Image(mask.astype(np.int8), affine)
@@ -0,0 +1,112 @@
+"""Real/pseudo pairs of participants, indexed by integer subject codes."""
+import numpy as np
+
+
+def subject_codes(labels):
+    """Normalize subject labels (``'sub-001'``, ``'001'``, ``1``) to zero-padded strings (``'001'``)."""
+    return np.array([str(label).replace('sub-', '').zfill(3) for label in np.asarray(labels)], dtype=object)
+
+
+def subject_numbers(labels):
+    """Integer codes of subject labels (``'sub-001'``, ``'001'``, ``1`` -> ``1``)."""
+    return np.array([int(str(label).replace('sub-', '')) for label in np.asarray(labels)], dtype=int)
+
+
+class PairIndex:
+    """All pairs of participants, with subjects as integer codes.
+
+    ``subjects`` are the sorted integer subject codes and pairs refer to
+    subjects by their position in it. The upper-triangle pairs (the rows of
+    ``all_pair_list.csv``) and the full, ordered pairs (``all_pair_list_with_reverse.csv``)
+    are index arrays in the order of those files (Real first, then by
+    subjects), each with a boolean mask of the real dyads. The index is
+    saved as a ``.npz`` file next to the pair lists.
+    """
+
+    _fields = ('subjects', 'upper_rows', 'upper_cols', 'upper_real', 'full_rows', 'full_cols', 'full_real')
+
+    def __init__(self, subjects, upper_rows, upper_cols, upper_real, full_rows, full_cols, full_real):
+        self.subjects = np.asarray(subjects, dtype=int)
+        self.upper_rows = np.asarray(upper_rows, dtype=int)
+        self.upper_cols = np.asarray(upper_cols, dtype=int)
+        self.upper_real = np.asarray(upper_real, dtype=bool)
+        self.full_rows = np.asarray(full_rows, dtype=int)
+        self.full_cols = np.asarray(full_cols, dtype=int)
+        self.full_real = np.asarray(full_real, dtype=bool)
+
+    @staticmethod
+    def _sorted(rows, cols, real):
+        # Real pairs first, then by Subject1 and Subject2
+        order = np.lexsort((cols, rows, ~real))
+        return rows[order], cols[order], real[order]
+
+    @classmethod
+    def from_real_pairs(cls, real_pair_ids, subjects=None):
+        """All pairs of the participants of the real pair list (``PairID`` values ``'<subject>_<subject>'``).
+
+        An upper-triangle pair is real if it is listed in that order, an
+        ordered pair if it is listed in either order (as in
+        ``create_pairlist_real_pseudo(_with_reverse).py``). Further
+        ``subjects`` (labels in any format) without a real pair yet are
+        added with pseudo pairs only.
+        """
+        ids = [str(pair_id).split('_') for pair_id in real_pair_ids]
+        first, second = subject_numbers([i[0] for i in ids]), subject_numbers([i[1] for i in ids])
+        extra = [] if subjects is None else [subject_numbers(subjects)]
+        subjects = np.unique(np.concatenate([first, second] + extra))
+        n_subs = len(subjects)
+        real = np.zeros((n_subs, n_subs), dtype=bool)
+        real[np.searchsorted(subjects, first), np.searchsorted(subjects, second)] = True
+        upper_rows, upper_cols = np.triu_indices(n_subs, 1)
+        full_rows, full_cols = np.nonzero(~np.eye(n_subs, dtype=bool))
+        upper = cls._sorted(upper_rows, upper_cols, real[upper_rows, upper_cols])
+        full = cls._sorted(full_rows, full_cols, (real | real.T)[full_rows, full_cols])
+        return cls(subjects, *upper, *full)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(**{key: data[key] for key in cls._fields})
+
+    def save(self, path):
+        np.savez(path, **{key: getattr(self, key) for key in self._fields})
+
+    def pairs(self, ordered=False):
+        """Subject positions (rows, cols) and real mask of the upper-triangle or the full (ordered) pairs."""
+        if ordered:
+            return self.full_rows, self.full_cols, self.full_real
+        return self.upper_rows, self.upper_cols, self.upper_real
+
+    def __len__(self):
+        return len(self.upper_rows)
+
+    def indices(self, subjects, ordered=False, real_only=False):
+        """Row and column indices of the pairs in matrices ordered by ``subjects`` (labels in any format)."""
+        rows, cols, real = self.pairs(ordered)
+        if real_only:
+            rows, cols = rows[real], cols[real]
+        # position of every indexed subject in ``subjects`` (-1 if missing)
+        numbers = subject_numbers(subjects)
+        order = np.argsort(numbers)
+        found = np.minimum(np.searchsorted(numbers[order], self.subjects), len(numbers) - 1)
+        lookup = np.where(numbers[order][found] == self.subjects, order[found], -1)
+        used = np.unique(np.concatenate([rows, cols]))
+        missing = self.subjects[used[lookup[used] < 0]]
+        if len(missing):
+            raise KeyError('Subjects missing from the matrices: %s' % sorted(missing.tolist()))
+        return lookup[rows], lookup[cols]
+
+    def frame(self, ordered=False):
+        """The pair list as written to the csv files: Subject1, Subject2 (zero-padded) and Pair_Type."""
+        import pandas as pd
+        rows, cols, real = self.pairs(ordered)
+        codes = subject_codes(self.subjects)
+        return pd.DataFrame({'Subject1': codes[rows], 'Subject2': codes[cols],
+            'Pair_Type': np.where(real, 'Real', 'Pseudo')})
+
+    def table(self, values, value_name, ordered=False):
+        """Long-format table with one row per pair: Pair_Type, Subject1, Subject2 and ``value_name``."""
+        import pandas as pd
+        pairs_df = self.frame(ordered)
+        return pd.DataFrame({'Pair_Type': pairs_df['Pair_Type'].values, 'Subject1': pairs_df['Subject1'].values,
+            'Subject2': pairs_df['Subject2'].values, value_name: values})
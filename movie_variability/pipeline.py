@@ -0,0 +1,221 @@
+"""Stage graph of the ISC and IS-RSA pipelines and a runner for it.
+
+Every stage is one script of ``01_ISC`` or ``02_IS-RSA`` together with the
+stages it depends on and the resources (cores, memory, walltime) one job of
+it needs. Stages that loop over movies are sharded: each shard is a separate
+job handling a subset of the movies, passed to the script in the
+``MOVIE_VARIABILITY_SHARD`` environment variable (e.g. ``movie=movie3``) and
+read there with ``shard_values``.
+
+The graph runs either locally, as a pool of processes on one machine whose
+jobs together use at most the available cores, or on Torque, where each
+stage is submitted as a (array) job depending on the jobs of its
+prerequisite stages::
+
+    python -m movie_variability.pipeline --list
+    python -m movie_variability.pipeline isrsa --cores 16
+    python -m movie_variability.pipeline --backend torque
+"""
+import os
+import sys
+import time
+import argparse
+import itertools
+import subprocess
+
+SHARD_ENV = 'MOVIE_VARIABILITY_SHARD'
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MOVIES = ['movie1', 'movie2', 'movie3', 'movie4', 'movie5', 'movie6', 'movie7', 'movie8']
+
+
+def shard_values(dim, values):
+    """The entries of ``values`` (labels of dimension ``dim``) this process should handle.
+
+    Without a shard specification for ``dim`` all values are returned.
+    """
+    spec = os.environ.get(SHARD_ENV, '')
+    for part in filter(None, spec.split(';')):
+        key, _, selected = part.partition('=')
+        if key == dim:
+            selected = selected.split(',')
+            return [value for value in values if str(value) in selected]
+    return list(values)
+
+
+class Stage:
+    """One script of the pipeline, its prerequisite stages and the resources of one of its jobs.
+
+    ``shards`` maps dimensions to the labels to shard over (one job per
+    combination of labels), e.g. ``{'movie': MOVIES}``.
+    """
+
+    def __init__(self, name, script, deps=(), shards=None, cores=1, mem='4gb', walltime='01:00:00'):
+        self.name = name
+        self.script = script
+        self.deps = list(deps)
+        self.shards = shards or {}
+        self.cores = cores
+        self.mem = mem
+        self.walltime = walltime
+
+    def jobs(self):
+        """(job name, shard specification) of every job of the stage."""
+        if not self.shards:
+            return [(self.name, '')]
+        dims = list(self.shards)
+        return [('%s_%s' % (self.name, '_'.join(str(value) for value in combination)),
+            ';'.join('%s=%s' % (dim, value) for dim, value in zip(dims, combination)))
+            for combination in itertools.product(*(self.shards[dim] for dim in dims))]
+
+
+STAGES = [
+    Stage('mask', '01_ISC/create_movies_mask.py', cores=4, mem='16gb'),
+    Stage('extract', '01_ISC/extract_timeseries.py', ['mask'], shards={'movie': MOVIES},
+        cores=8, mem='16gb', walltime='04:00:00'),
+    Stage('pairlist', '01_ISC/create_pairlist_real_pseudo.py'),
+    Stage('pairlist_reverse', '01_ISC/create_pairlist_real_pseudo_with_reverse.py', ['pairlist']),
+    Stage('isc', '01_ISC/create_isc_matrices.py', ['extract', 'pairlist_reverse'],
+        cores=4, mem='32gb', walltime='02:00:00'),
+    Stage('isc_pairs', '01_ISC/create_pair_dataset.py', ['isc', 'pairlist_reverse'], shards={'movie': MOVIES},
+        mem='8gb'),
+    Stage('isc_anova', '01_ISC/isc_anova.py', ['isc', 'pairlist_reverse'], mem='8gb'),
+    Stage('visualize_anova', '01_ISC/visualize_anova.py', ['isc_anova']),
+    Stage('distance', '02_IS-RSA/create_is-distance_matrices.py', ['extract'], mem='32gb'),
+    Stage('neural_pairs', '02_IS-RSA/create_neural_pair_dataset.py', ['distance', 'pairlist_reverse'],
+        shards={'movie': MOVIES}, mem='8gb'),
+    Stage('behavioral', '02_IS-RSA/create_behavioral_matrices.py', mem='8gb'),
+    Stage('control', '02_IS-RSA/create_control_matrices.py'),
+    Stage('isrsa', '02_IS-RSA/run_isrsa.py', ['distance', 'behavioral', 'control', 'pairlist_reverse'],
+        shards={'movie': MOVIES}, cores=8, mem='16gb', walltime='04:00:00'),
+    Stage('visualize_isrsa', '02_IS-RSA/visualize_movie_ISRSA_results.py', ['isrsa'], cores=8, mem='8gb'),
+    Stage('format_isrsa', '02_IS-RSA/format_ISRSA_results.py', ['isrsa']),
+]
+
+
+def select_stages(targets=None, stages=STAGES):
+    """The stages needed for ``targets`` (names; default: all), prerequisites first."""
+    by_name = {stage.name: stage for stage in stages}
+    unknown = set(targets or []) - set(by_name)
+    if unknown:
+        raise KeyError('Unknown stage(s) %s, known stages: %s' % (sorted(unknown), list(by_name)))
+    needed = set()
+    todo = list(targets or by_name)
+    while todo:
+        name = todo.pop()
+        if name not in needed:
+            needed.add(name)
+            todo.extend(by_name[name].deps)
+    # STAGES is listed in dependency order
+    return [stage for stage in stages if stage.name in needed]
+
+
+def run_local(stages, max_cores=None, log_dir=None, poll_interval=1.0):
+    """Run the jobs of ``stages`` on this machine, at most ``max_cores`` cores at a time.
+
+    A job starts once all jobs of its prerequisite stages succeeded; jobs of
+    failed stages' dependents are skipped. Each job writes its output to
+    ``<log_dir>/<job>.log``. Returns the names of the failed and skipped jobs.
+    """
+    max_cores = max_cores or os.cpu_count()
+    log_dir = log_dir or os.path.join(ROOT, 'pipeline_logs')
+    os.makedirs(log_dir, exist_ok=True)
+    waiting = [(stage, name, spec) for stage in stages for name, spec in stage.jobs()]
+    remaining = {stage.name: len(stage.jobs()) for stage in stages}
+    failed_stages, failed, running = set(), [], {}
+    while waiting or running:
+        used = sum(job[1] for job in running.values())
+        for job in list(waiting):
+            stage, name, spec = job
+            if any(dep in failed_stages for dep in stage.deps):
+                waiting.remove(job)
+                failed.append(name)
+                failed_stages.add(stage.name)
+                print('Skipped %s (a prerequisite failed)' % name)
+                continue
+            if any(remaining.get(dep, 0) for dep in stage.deps):
+                continue
+            if running and used + stage.cores > max_cores:
+                continue
+            log = open(os.path.join(log_dir, '%s.log' % name), 'w')
+            env = dict(os.environ, **{SHARD_ENV: spec})
+            process = subprocess.Popen([sys.executable, os.path.join(ROOT, stage.script)],
+                cwd=os.path.dirname(os.path.join(ROOT, stage.script)), env=env, stdout=log, stderr=subprocess.STDOUT)
+            running[process] = (stage, stage.cores, name, log)
+            used += stage.cores
+            waiting.remove(job)
+            print('Started %s' % name)
+        time.sleep(poll_interval if running else 0)
+        for process in [process for process in running if process.poll() is not None]:
+            stage, _, name, log = running.pop(process)
+            log.close()
+            remaining[stage.name] -= 1
+            if process.returncode == 0:
+                print('Finished %s' % name)
+            else:
+                failed.append(name)
+                failed_stages.add(stage.name)
+                print('Failed %s (exit code %d, see %s)' % (name, process.returncode, log.name))
+    return failed
+
+
+def submit_torque(stages, log_dir=None, dry_run=False):
+    """Submit ``stages`` to Torque, sharded stages as array jobs, with dependencies between stages.
+
+    Returns the job IDs by stage name.
+    """
+    log_dir = log_dir or os.path.join(ROOT, 'pipeline_logs')
+    os.makedirs(log_dir, exist_ok=True)
+    by_name = {stage.name: stage for stage in stages}
+    job_ids = {}
+    for stage in stages:
+        specs = [spec for _, spec in stage.jobs()]
+        script_path = os.path.join(log_dir, '%s.sh' % stage.name)
+        with open(script_path, 'w') as f:
+            f.write('#!/bin/bash\n')
+            f.write('cd %s\n' % os.path.dirname(os.path.join(ROOT, stage.script)))
+            if stage.shards:
+                f.write('SHARDS=(%s)\n' % ' '.join('"%s"' % spec for spec in specs))
+                f.write('export %s="${SHARDS[$PBS_ARRAYID]}"\n' % SHARD_ENV)
+            f.write('python %s\n' % os.path.join(ROOT, stage.script))
+        args = ['qsub', '-N', stage.name, '-j', 'oe', '-o', log_dir,
+            '-l', 'nodes=1:ppn=%d,walltime=%s,mem=%s' % (stage.cores, stage.walltime, stage.mem)]
+        if stage.shards:
+            args += ['-t', '0-%d' % (len(specs) - 1)]
+        depends = [('afterokarray:%s' if by_name[dep].shards else 'afterok:%s') % job_ids[dep]
+            for dep in stage.deps if dep in job_ids]
+        if depends:
+            args += ['-W', 'depend=%s' % ','.join(depends)]
+        args.append(script_path)
+        if dry_run:
+            print(' '.join(args))
+            job_ids[stage.name] = stage.name
+        else:
+            job_ids[stage.name] = subprocess.run(args, check=True, capture_output=True, text=True).stdout.strip()
+            print('Submitted %s as %s' % (stage.name, job_ids[stage.name]))
+    return job_ids
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the ISC and IS-RSA pipeline stages.')
+    parser.add_argument('targets', nargs='*', help='stages to run (with their prerequisites); default: all')
+    parser.add_argument('--backend', choices=['local', 'torque'], default='local')
+    parser.add_argument('--cores', type=int, default=None, help='cores used by the local backend')
+    parser.add_argument('--log-dir', default=None)
+    parser.add_argument('--list', action='store_true', help='only list the jobs of the selected stages')
+    parser.add_argument('--dry-run', action='store_true', help='print the qsub commands without submitting')
+    args = parser.parse_args(argv)
+    stages = select_stages(args.targets)
+    if args.list:
+        for stage in stages:
+            print('%-18s %-50s deps=%s cores=%d mem=%s walltime=%s jobs=%d' % (stage.name, stage.script,
+                ','.join(stage.deps) or '-', stage.cores, stage.mem, stage.walltime, len(stage.jobs())))
+        return 0
+    if args.backend == 'torque':
+        submit_torque(stages, args.log_dir, dry_run=args.dry_run)
+        return 0
+    failed = run_local(stages, args.cores, args.log_dir)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,61 @@
+"""Subject x subject distance matrices from behavioral representational dissimilarity matrices and subject covariates."""
+import numpy as np
+
+from .store import MatrixStore
+
+METRICS = ('absolute', 'euclidean', 'mismatch')
+
+
+def session_matrices(rdm, n_subjects, n_sessions=2, n_items=16):
+    """Diagonal-averaged subject x subject matrices of every session.
+
+    ``rdm`` is a square (subjects * sessions * items) matrix whose rows and
+    columns are ordered by subject, then session, then item (e.g. the
+    ``B2`` features or ``naming_RDM`` matrices). For each pair of subjects
+    the distances between the same item in the same session are averaged.
+    The matrices are symmetrized from the upper triangle and have a zero
+    diagonal. Returns an array (sessions x subjects x subjects).
+    """
+    rdm = np.asarray(rdm, dtype=float).reshape(n_subjects, n_sessions, n_items, n_subjects, n_sessions, n_items)
+    sessions = np.arange(n_sessions)[:, None]
+    items = np.arange(n_items)[None, :]
+    # same session and item of both subjects: (sessions x items x subjects x subjects)
+    matrices = rdm[:, sessions, items, :, sessions, items].mean(axis=1)
+    upper = np.triu(matrices, 1)
+    return upper + np.swapaxes(upper, 1, 2)
+
+
+def covariate_distances(values, metric='absolute'):
+    """Subject x subject distance matrix of one or more covariate columns.
+
+    ``values`` is (subjects,) or (subjects x columns). ``metric`` is
+    ``'absolute'`` (absolute difference, summed over columns),
+    ``'euclidean'`` or ``'mismatch'`` (0 if all values are equal, 1 if not;
+    for categorical columns such as sex).
+    """
+    values = np.asarray(values)
+    if values.ndim == 1:
+        values = values[:, None]
+    if metric == 'mismatch':
+        return (values[:, None, :] != values[None, :, :]).any(axis=2).astype(float)
+    diff = values[:, None, :].astype(float) - values[None, :, :].astype(float)
+    if metric == 'absolute':
+        return np.abs(diff).sum(axis=2)
+    if metric == 'euclidean':
+        return np.sqrt((diff ** 2).sum(axis=2))
+    raise ValueError('Unknown metric %r, expected one of %s' % (metric, METRICS))
+
+
+def save_covariate_store(path, subject_table, covariates, subject_column='PID'):
+    """Compute covariate distance matrices of all subjects into a new ``MatrixStore``.
+
+    ``subject_table`` is a DataFrame with one row per subject;
+    ``covariates`` maps a name to ``(columns, metric)``, e.g.
+    ``{'age': ('age', 'absolute'), 'sex': ('sex_char', 'mismatch')}``. The
+    store has one dimension, ``covariate``. Returns the store.
+    """
+    store = MatrixStore.create(path, {'covariate': list(covariates)}, subject_table[subject_column])
+    for name, (columns, metric) in covariates.items():
+        store.set(covariate_distances(subject_table[columns].values, metric), covariate=name)
+    store.flush()
+    return store
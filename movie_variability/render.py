@@ -0,0 +1,84 @@
+"""Batch rendering of parcel maps as glass-brain figures.
+
+All maps of a batch are projected to voxel space in one step with
+``Atlas.to_brain``, and the figures are drawn in a pool of worker processes
+with the non-interactive Agg backend. A figure is only redrawn when its map
+or plotting options changed: a hash of both is kept per output directory in
+``.render_hashes.json``.
+"""
+import os
+import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+HASH_FILE = '.render_hashes.json'
+
+
+def _render_key(values, plot_kwargs, dpi):
+    digest = hashlib.sha256(np.ascontiguousarray(values, dtype=np.float64).tobytes())
+    digest.update(json.dumps([plot_kwargs, dpi], sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+def _load_hashes(dir_out):
+    path = os.path.join(dir_out, HASH_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _render_one(volume, affine, out_path, plot_kwargs, dpi):
+    import matplotlib
+    import matplotlib.pyplot as plt
+    import nibabel as nib
+    from nilearn import plotting as nplot
+
+    if matplotlib.get_backend().lower() != 'agg':
+        plt.switch_backend('Agg')
+    nplot.plot_glass_brain(nib.Nifti1Image(volume, affine), **plot_kwargs)
+    plt.savefig(out_path, dpi=dpi)
+    plt.close('all')
+    return out_path
+
+
+def render_glass_brains(atlas, maps, out_paths, plot_kwargs=None, dpi=400, n_jobs=1, force=False):
+    """Render parcel maps (maps x parcels) of ``atlas`` as glass brains saved to ``out_paths``.
+
+    ``plot_kwargs`` (e.g. ``cmap``, ``vmin``, ``vmax``, ``colorbar``) are passed
+    to ``plot_glass_brain``; either one dict for all maps or a list with one
+    dict per map. Figures whose map and options are unchanged since they were
+    last rendered are skipped unless ``force`` is set. Returns the paths of
+    the figures that were rendered.
+    """
+    maps = np.atleast_2d(np.asarray(maps, dtype=float))
+    out_paths = [str(path) for path in out_paths]
+    if plot_kwargs is None or isinstance(plot_kwargs, dict):
+        plot_kwargs = [dict(plot_kwargs or {})] * len(maps)
+    keys = [_render_key(values, kwargs, dpi) for values, kwargs in zip(maps, plot_kwargs)]
+    hashes = {}
+    for path in out_paths:
+        dir_out = os.path.dirname(os.path.abspath(path))
+        if dir_out not in hashes:
+            hashes[dir_out] = _load_hashes(dir_out)
+    todo = [i for i, path in enumerate(out_paths) if force or not os.path.exists(path)
+        or hashes[os.path.dirname(os.path.abspath(path))].get(os.path.basename(path)) != keys[i]]
+    if not todo:
+        return []
+    # one projection of all maps to be rendered (maps x X x Y x Z)
+    volumes = atlas.to_brain(maps[todo]).astype(np.float32)
+    args = [(volumes[k], atlas.affine, out_paths[i], plot_kwargs[i], dpi) for k, i in enumerate(todo)]
+    if n_jobs == 1:
+        rendered = [_render_one(*arg) for arg in args]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            rendered = list(pool.map(_render_one, *zip(*args)))
+    for i in todo:
+        dir_out = os.path.dirname(os.path.abspath(out_paths[i]))
+        hashes[dir_out][os.path.basename(out_paths[i])] = keys[i]
+    for dir_out in {os.path.dirname(os.path.abspath(out_paths[i])) for i in todo}:
+        with open(os.path.join(dir_out, HASH_FILE), 'w') as f:
+            json.dump(hashes[dir_out], f, indent=1, sort_keys=True)
+    return rendered
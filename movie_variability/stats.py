@@ -0,0 +1,34 @@
+"""Multiple-comparison helpers shared by the statistics engines."""
+import numpy as np
+
+
+def fdr_correction(p):
+    """Benjamini-Hochberg adjusted p-values (same as statsmodels' ``fdrcorrection``)."""
+    p = np.asarray(p, dtype=float)
+    n = p.size
+    order = np.argsort(p)
+    ranked = p[order] * n / np.arange(1, n + 1)
+    ranked = np.minimum.accumulate(ranked[::-1])[::-1]
+    p_fdr = np.empty(n)
+    p_fdr[order] = np.minimum(ranked, 1)
+    return p_fdr
+
+
+def rm_anova(values):
+    """One-way repeated-measures ANOVA for many dependent variables at once.
+
+    ``values`` is (subjects x conditions x ...); every trailing index is an
+    independent balanced design (e.g. one per parcel). Returns the F values
+    and uncorrected p-values with shape ``values.shape[2:]``.
+    """
+    from scipy import stats
+
+    values = np.asarray(values, dtype=float)
+    n_subs, n_conds = values.shape[:2]
+    grand_mean = values.mean(axis=(0, 1))
+    ss_cond = n_subs * ((values.mean(axis=0) - grand_mean) ** 2).sum(axis=0)
+    ss_subj = n_conds * ((values.mean(axis=1) - grand_mean) ** 2).sum(axis=0)
+    ss_error = ((values - grand_mean) ** 2).sum(axis=(0, 1)) - ss_cond - ss_subj
+    df_cond, df_error = n_conds - 1, (n_subs - 1) * (n_conds - 1)
+    F = (ss_cond / df_cond) / (ss_error / df_error)
+    return F, stats.f.sf(F, df_cond, df_error)
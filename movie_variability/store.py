@@ -0,0 +1,146 @@
+"""Binary, memory-mapped storage for pipeline arrays.
+
+Timeseries cubes (subjects x TRs x parcels, one per movie) are written by
+``extract_timeseries.py`` with ``save_timeseries_cube`` and read back by the
+matrix builders with ``load_timeseries_cube``.
+
+A matrix store is a pair of files sharing one base path: ``<path>.npy`` holds a
+single array of shape (*leading dims, subjects, subjects), e.g.
+(movie, parcel, subject, subject), and ``<path>.json`` records the labels of
+every axis. Readers open the array with memory mapping, so slicing one
+movie/parcel only touches that matrix on disk.
+"""
+import os
+import json
+import hashlib
+import numpy as np
+
+
+def array_checksum(data, block_size=1 << 24):
+    """SHA-256 hex digest of an array's contents.
+
+    The array is hashed a block of about ``block_size`` bytes of leading-axis
+    slices at a time, so a memory-mapped array is never copied as a whole.
+    """
+    data = np.asarray(data)
+    digest = hashlib.sha256()
+    if data.ndim == 0 or data.size == 0:
+        digest.update(np.ascontiguousarray(data).tobytes())
+        return digest.hexdigest()
+    rows = max(1, block_size // max(1, data[0].nbytes))
+    for start in range(0, len(data), rows):
+        digest.update(np.ascontiguousarray(data[start:start + rows]).data)
+    return digest.hexdigest()
+
+
+def save_timeseries_cube(path, data, subjects, dtype=np.float32):
+    """Save a (subjects x TRs x parcels) cube as ``<path>.npy`` plus ``<path>.json`` metadata."""
+    path = str(path)
+    data = np.asarray(data, dtype=dtype)
+    subjects = [str(subj) for subj in subjects]
+    if data.ndim != 3 or data.shape[0] != len(subjects):
+        raise ValueError('Expected a (subjects x TRs x parcels) array for %d subjects, got shape %s'
+            % (len(subjects), data.shape))
+    np.save(path + '.npy', data)
+    with open(path + '.json', 'w') as f:
+        json.dump({'subjects': subjects, 'shape': list(data.shape), 'dtype': data.dtype.name,
+            'sha256': array_checksum(data)}, f, indent=1)
+
+
+def load_timeseries_cube(path, mmap_mode='r', verify=True):
+    """Load a cube written by ``save_timeseries_cube``; returns ``(data, subjects)``.
+
+    With ``verify`` the stored checksum is compared against the array on disk.
+    """
+    path = str(path)
+    with open(path + '.json') as f:
+        meta = json.load(f)
+    data = np.load(path + '.npy', mmap_mode=mmap_mode)
+    if verify and array_checksum(data) != meta['sha256']:
+        raise ValueError('Checksum mismatch for timeseries cube %s.npy' % path)
+    return data, meta['subjects']
+
+
+class MatrixStore:
+    """Labelled stack of subject x subject matrices backed by a memory-mapped ``.npy`` file.
+
+    Matrices are addressed by label, e.g. ``store.get(movie='movie1', parcel=5)``.
+    Leaving a dimension out selects all of its entries.
+    """
+
+    def __init__(self, path, mode='r'):
+        self.path = str(path)
+        with open(self.path + '.json') as f:
+            meta = json.load(f)
+        self.dims = meta['dims']
+        self.coords = meta['coords']
+        self.subjects = meta['subjects']
+        self.data = np.load(self.path + '.npy', mmap_mode=mode)
+
+    @classmethod
+    def create(cls, path, coords, subjects, dtype=np.float64):
+        """Allocate a new store; ``coords`` maps each leading dimension to its labels (in order)."""
+        path = str(path)
+        dims = list(coords)
+        coords = {dim: list(labels) for dim, labels in coords.items()}
+        subjects = [str(subj) for subj in subjects]
+        shape = tuple(len(coords[dim]) for dim in dims) + (len(subjects), len(subjects))
+        data = np.lib.format.open_memmap(path + '.npy', mode='w+', dtype=dtype, shape=shape)
+        del data
+        with open(path + '.json', 'w') as f:
+            json.dump({'dims': dims, 'coords': coords, 'subjects': subjects}, f, indent=1)
+        return cls(path, mode='r+')
+
+    @staticmethod
+    def exists(path):
+        return os.path.exists(str(path) + '.npy') and os.path.exists(str(path) + '.json')
+
+    def index(self, **labels):
+        """Translate labels into a tuple of array indices."""
+        unknown = set(labels) - set(self.dims)
+        if unknown:
+            raise KeyError('Unknown dimension(s) %s, store has %s' % (sorted(unknown), self.dims))
+        return tuple(self.coords[dim].index(labels[dim]) if dim in labels else slice(None)
+            for dim in self.dims)
+
+    def get(self, **labels):
+        return self.data[self.index(**labels)]
+
+    def set(self, matrices, **labels):
+        self.data[self.index(**labels)] = matrices
+
+    def add_subjects(self, subjects):
+        """Grow the subject axes, appending ``subjects`` after the existing ones.
+
+        Existing matrices are copied over and the new rows/columns are set to
+        NaN until they are filled in. Returns the enlarged store opened for writing.
+        """
+        subjects = [str(subj) for subj in subjects]
+        n_old = len(self.subjects)
+        tmp_path = self.path + '.tmp'
+        grown = MatrixStore.create(tmp_path, self.coords, self.subjects + subjects, dtype=self.data.dtype)
+        for idx in np.ndindex(*self.data.shape[:len(self.dims)]):
+            grown.data[idx] = np.nan
+            grown.data[idx][:n_old, :n_old] = self.data[idx]
+        grown.flush()
+        del grown
+        self.data = None
+        for suffix in ['.npy', '.json']:
+            os.replace(tmp_path + suffix, self.path + suffix)
+        return MatrixStore(self.path, mode='r+')
+
+    def flush(self):
+        if isinstance(self.data, np.memmap):
+            self.data.flush()
+
+    def to_frame(self, **labels):
+        """One matrix as a DataFrame indexed by subject ID (all leading dims must be given)."""
+        import pandas as pd
+        return pd.DataFrame(np.asarray(self.get(**labels)), index=self.subjects, columns=self.subjects)
+
+    def export_csv(self, dir_out, pattern):
+        """Write every matrix to its own CSV, e.g. ``pattern='ISC_{movie}_parcel{parcel}.csv'``."""
+        for idx in np.ndindex(*self.data.shape[:len(self.dims)]):
+            labels = {dim: self.coords[dim][i] for dim, i in zip(self.dims, idx)}
+            self.to_frame(**labels).to_csv(os.path.join(dir_out, pattern.format(**labels)),
+                index=True, header=True)
@@ -0,0 +1,60 @@
+"""Synthetic stand-ins for the project data, shaped like the real inputs of every stage.
+
+Used by ``movie_variability.benchmark`` to time the stages without the data
+under ``/project``. All generators take a ``random_state`` and return the
+same data for the same arguments.
+"""
+import numpy as np
+
+
+def subject_ids(n_subjects):
+    """Zero-padded subject IDs as in ``subjectlist.csv`` (``'001'``, ``'002'``, ...)."""
+    return ['%03d' % (i + 1) for i in range(n_subjects)]
+
+
+def real_pair_ids(n_subjects):
+    """``PairID`` values of ``real_pair_list.csv``: consecutive subjects form a dyad (``'001_002'``, ...)."""
+    subjects = subject_ids(n_subjects - n_subjects % 2)
+    return ['%s_%s' % pair for pair in zip(subjects[::2], subjects[1::2])]
+
+
+def timeseries_cube(n_subjects, n_trs, n_parcels, shared=0.3, random_state=None):
+    """A (subjects x TRs x parcels) float32 cube with a planted stimulus-driven signal.
+
+    Every parcel has one time course shared by all subjects, mixed with
+    independent noise per subject. The shared variance rises linearly from
+    0 to ``2 * shared`` across parcels (capped at 0.9), so the expected ISC
+    ranges from 0 in the first parcel to high values in the last ones.
+    """
+    rng = np.random.default_rng(random_state)
+    weight = np.minimum(np.linspace(0, 2 * shared, n_parcels), 0.9)
+    signal = rng.standard_normal((1, n_trs, n_parcels), dtype=np.float32)
+    cube = rng.standard_normal((n_subjects, n_trs, n_parcels), dtype=np.float32)
+    cube *= np.sqrt(1 - weight).astype(np.float32)
+    cube += np.sqrt(weight).astype(np.float32) * signal
+    return cube
+
+
+def behavioral_rdm(n_subjects, n_sessions=2, n_items=16, n_features=8, random_state=None):
+    """A square (subjects * sessions * items) RDM ordered like ``B2`` and ``naming_RDM``.
+
+    Each subject describes every item with a noisy copy of a common feature
+    vector; dyad partners share part of their noise, so real pairs are
+    closer than pseudo pairs. Entries are Euclidean distances.
+    """
+    rng = np.random.default_rng(random_state)
+    items = rng.standard_normal((1, 1, n_items, n_features))
+    dyads = rng.standard_normal(((n_subjects + 1) // 2, n_sessions, n_items, n_features))
+    noise = rng.standard_normal((n_subjects, n_sessions, n_items, n_features))
+    descriptions = (items + 0.5 * dyads[np.arange(n_subjects) // 2] + noise).reshape(-1, n_features)
+    diff = descriptions[:, None, :] - descriptions[None, :, :]
+    return np.sqrt((diff ** 2).sum(axis=2))
+
+
+def covariate_table(n_subjects, random_state=None):
+    """Subject table like ``subjectlist_age_sex.csv`` (PID, age, sex_char)."""
+    import pandas as pd
+    rng = np.random.default_rng(random_state)
+    return pd.DataFrame({'PID': subject_ids(n_subjects),
+        'age': rng.integers(18, 40, size=n_subjects),
+        'sex_char': rng.choice(['F', 'M'], size=n_subjects)})
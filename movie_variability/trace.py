@@ -0,0 +1,195 @@
+"""Timing and memory trace of the pipeline stages.
+
+A stage script creates one ``Tracer`` and wraps its sub-steps (load,
+compute, bootstrap, write, plot, ...) in spans, labelled e.g. by movie or
+parcel range::
+
+    tracer = Tracer('create_isc_matrices')
+    with tracer.span('load', movie=movie) as span:
+        data = ...
+        span.items = len(data)
+    tracer.summary()
+
+Every finished span is appended to a JSON lines file as one record with
+its wall and CPU time, the peak resident memory of the process so far and
+of its largest finished child process (e.g. a pool worker), the bytes read
+and written during the span and the number of items it processed. Library
+code can open spans with the module-level ``span``, which records into the
+active tracer (if any). Traces of several stages and runs are summarised
+with::
+
+    python -m movie_variability.trace pipeline_logs/trace/*.jsonl
+"""
+import os
+import sys
+import json
+import time
+import socket
+import resource
+import argparse
+import contextlib
+
+from .pipeline import ROOT, SHARD_ENV
+
+TRACE_ENV = 'MOVIE_VARIABILITY_TRACE_DIR'
+
+_active = None
+
+
+def _io_counters():
+    """Bytes read and written by this process so far (``None`` where /proc is unavailable)."""
+    try:
+        with open('/proc/self/io') as f:
+            counters = dict(line.split(': ') for line in f.read().splitlines())
+        return int(counters['rchar']), int(counters['wchar'])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+def _cpu_time():
+    """CPU time of this process and its finished child processes (e.g. worker pools)."""
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def _peak_rss_mb(who=resource.RUSAGE_SELF):
+    # ru_maxrss is reported in kilobytes on Linux; for RUSAGE_CHILDREN it is the
+    # peak of the largest finished child process
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+class Span:
+    """One timed sub-step; set ``items`` to the number of items (subjects, parcels, ...) it processed."""
+
+    def __init__(self, name, labels, parent=None):
+        self.name = name
+        self.path = parent.path + '/' + name if parent is not None else name
+        self.labels = labels
+        self.items = None
+
+    def start(self):
+        self._start = time.time()
+        self._wall = time.perf_counter()
+        self._cpu = _cpu_time()
+        self._read, self._written = _io_counters()
+
+    def finish(self):
+        read, written = _io_counters()
+        return {'span': self.name, 'path': self.path, 'labels': self.labels, 'start': self._start,
+            'wall_s': time.perf_counter() - self._wall, 'cpu_s': _cpu_time() - self._cpu,
+            'peak_rss_mb': _peak_rss_mb(), 'children_peak_rss_mb': _peak_rss_mb(resource.RUSAGE_CHILDREN),
+            'read_bytes': None if read is None else read - self._read,
+            'written_bytes': None if written is None else written - self._written,
+            'items': self.items}
+
+
+class Tracer:
+    """Trace of one run of a stage, appended to ``<trace_dir>/<stage>[_<shard>].jsonl``.
+
+    ``trace_dir`` defaults to the ``MOVIE_VARIABILITY_TRACE_DIR`` environment
+    variable, or ``pipeline_logs/trace`` in the repository root. The tracer
+    becomes the active tracer used by the module-level ``span``.
+    """
+
+    def __init__(self, stage, trace_dir=None):
+        global _active
+        self.stage = stage
+        self.shard = os.environ.get(SHARD_ENV, '')
+        trace_dir = trace_dir or os.environ.get(TRACE_ENV) or os.path.join(ROOT, 'pipeline_logs', 'trace')
+        os.makedirs(trace_dir, exist_ok=True)
+        suffix = ''.join(c if c.isalnum() else '_' for c in self.shard)
+        self.path = os.path.join(trace_dir, '%s%s.jsonl' % (stage, '_' + suffix if suffix else ''))
+        self.run = '%s-%d-%d' % (socket.gethostname(), os.getpid(), int(time.time()))
+        self.records = []
+        self._stack = []
+        _active = self
+
+    @contextlib.contextmanager
+    def span(self, name, **labels):
+        """Time the enclosed block as span ``name`` (nested in the enclosing span, if any)."""
+        current = Span(name, labels, self._stack[-1] if self._stack else None)
+        self._stack.append(current)
+        current.start()
+        try:
+            yield current
+        finally:
+            self._stack.pop()
+            self._write(current.finish())
+
+    def _write(self, record):
+        record = dict({'stage': self.stage, 'shard': self.shard, 'run': self.run}, **record)
+        self.records.append(record)
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+    def summary(self, file=None):
+        """Print the summary table of the spans of this run; returns its rows."""
+        rows = summarize(self.records)
+        print_summary(rows, file=file)
+        return rows
+
+
+@contextlib.contextmanager
+def span(name, **labels):
+    """Span of the active tracer; does nothing if no tracer was created."""
+    if _active is None:
+        yield Span(name, labels)
+    else:
+        with _active.span(name, **labels) as current:
+            yield current
+
+
+def read_trace(paths):
+    """All records of the given JSON lines trace files."""
+    records = []
+    for path in paths:
+        with open(path) as f:
+            records.extend(json.loads(line) for line in f if line.strip())
+    return records
+
+
+def summarize(records):
+    """Totals per (stage, span path): count, wall and CPU time, peak memory (own and children), I/O and items."""
+    rows = {}
+    for record in sorted(records, key=lambda record: record['start']):
+        row = rows.setdefault((record['stage'], record['path']), {'stage': record['stage'], 'span': record['path'],
+            'count': 0, 'wall_s': 0.0, 'cpu_s': 0.0, 'peak_rss_mb': 0.0, 'children_peak_rss_mb': 0.0,
+            'read_mb': 0.0, 'written_mb': 0.0, 'items': 0})
+        row['count'] += 1
+        row['wall_s'] += record['wall_s']
+        row['cpu_s'] += record['cpu_s']
+        row['peak_rss_mb'] = max(row['peak_rss_mb'], record['peak_rss_mb'])
+        # traces written before children were recorded have no children_peak_rss_mb
+        row['children_peak_rss_mb'] = max(row['children_peak_rss_mb'], record.get('children_peak_rss_mb') or 0.0)
+        row['read_mb'] += (record['read_bytes'] or 0) / 1024**2
+        row['written_mb'] += (record['written_bytes'] or 0) / 1024**2
+        row['items'] += record['items'] or 0
+    return list(rows.values())
+
+
+def print_summary(rows, file=None):
+    columns = ['stage', 'span', 'count', 'wall_s', 'cpu_s', 'peak_rss_mb', 'children_peak_rss_mb', 'read_mb',
+        'written_mb', 'items']
+    widths = [max([len(column)] + [len(_format(row[column])) for row in rows]) for column in columns]
+    print('  '.join(column.ljust(width) for column, width in zip(columns, widths)), file=file or sys.stdout)
+    for row in rows:
+        print('  '.join(_format(row[column]).ljust(width) for column, width in zip(columns, widths)),
+            file=file or sys.stdout)
+
+
+def _format(value):
+    return '%.2f' % value if isinstance(value, float) else str(value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Summarise pipeline trace files.')
+    parser.add_argument('paths', nargs='+', help='JSON lines trace files')
+    parser.add_argument('--run', default=None, help='only summarise this run')
+    args = parser.parse_args(argv)
+    records = [record for record in read_trace(args.paths) if args.run is None or record['run'] == args.run]
+    print_summary(summarize(records))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,19 @@
+import json
+
+from movie_variability import benchmark
+
+
+def test_run_warms_up_and_compare_skips_blank_lines(tmp_path, monkeypatch, capsys):
+    calls = []
+    monkeypatch.setitem(benchmark.STAGES, 'count', (lambda inputs: calls.append(inputs.n_subjects), None))
+    monkeypatch.setattr(benchmark, 'environment', lambda: {'commit': None})
+    out_path = tmp_path / 'base.jsonl'
+    records = benchmark.run(['count'], [4], [10], [3], repeat=2, out_path=str(out_path))
+    # one untimed warm-up run before the timed repeats
+    assert len(calls) == 3 and len(records[0]['times_s']) == 2
+    new_path = tmp_path / 'new.jsonl'
+    new_path.write_text('\n' + json.dumps(dict(records[0], best_s=records[0]['best_s'] / 2 or 1.0)) + '\n\n')
+    with open(out_path, 'a') as f:
+        f.write('\n')
+    benchmark.compare(str(out_path), str(new_path))
+    assert 'count' in capsys.readouterr().out.splitlines()[-1]
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from movie_variability import synthetic
+from movie_variability.isc import loo_isc
+
+
+def _brute_force_loo(data):
+    data = np.asarray(data, dtype=np.float64)
+    n_subs, _, n_parcels = data.shape
+    isc = np.empty((n_parcels, n_subs))
+    for subj in range(n_subs):
+        others = np.delete(data, subj, axis=0).mean(axis=0)
+        for parcel in range(n_parcels):
+            isc[parcel, subj] = np.corrcoef(data[subj, :, parcel], others[:, parcel])[0, 1]
+    return isc
+
+
+@pytest.mark.parametrize('dtype, atol', [(np.float64, 1e-12), (np.float32, 1e-5)])
+def test_loo_isc_matches_brute_force(dtype, atol):
+    data = synthetic.timeseries_cube(12, 80, 7, random_state=0)
+    # offsets and scales differing by subject and parcel, removed by the correlation
+    data = data * np.linspace(0.5, 3, 12)[:, None, None] + np.arange(7) * 10
+    result = loo_isc(data, dtype=dtype)
+    assert result.shape == (7, 12)
+    assert result.dtype == dtype
+    np.testing.assert_allclose(result, _brute_force_loo(data), rtol=0, atol=atol)
+
+
+def test_loo_isc_constant_timeseries_is_nan():
+    data = synthetic.timeseries_cube(5, 40, 3, random_state=1)
+    data[2, :, 1] = 4.0
+    result = loo_isc(data)
+    assert np.isnan(result[1, 2])
+    assert np.isfinite(np.delete(result, 2, axis=1)).all()
+
+
+def test_chunked_isc_matches_default_path_and_traces_its_steps(tmp_path, monkeypatch):
+    from movie_variability import trace
+    from movie_variability.isc import bootstrap_isc, chunked_isc, pairwise_isc
+
+    monkeypatch.setattr(trace, '_active', None)
+    tracer = trace.Tracer('test', trace_dir=str(tmp_path))
+    data = synthetic.timeseries_cube(10, 60, 9, random_state=2)
+    out = np.empty((9, 10, 10), dtype=np.float32)
+    stats = chunked_isc(data, out=out, n_bootstraps=200, memory_limit=1, chunk_size=4, random_state=0,
+        labels={'movie': 'movie1'})
+    expected = pairwise_isc(data)
+    expected_stats = bootstrap_isc(expected, n_bootstraps=200, random_state=0)
+    np.testing.assert_allclose(out, expected, atol=1e-5)
+    for key in ['isc', 'ci_lower', 'ci_upper']:
+        np.testing.assert_allclose(stats[key], expected_stats[key], atol=1e-4)
+    # the same steps as the default path, one of each per chunk of parcels
+    assert {record['span'] for record in tracer.records} == {'compute', 'write', 'bootstrap'}
+    assert all(record['labels']['movie'] == 'movie1' for record in tracer.records)
+    assert sum(record['items'] for record in tracer.records if record['span'] == 'write') == 9
+
+
+@pytest.mark.parametrize('n_old', [4, 6, 9])
+def test_update_isc_from_the_subjects_of_the_standardized_timeseries(n_old):
+    from movie_variability.isc import pairwise_isc, standardize_timeseries, update_isc
+
+    data = synthetic.timeseries_cube(9, 50, 5, random_state=3).astype(np.float64)
+    # a store already grown to 9 subjects, with only the first n_old computed for this movie
+    stored = np.full((5, 9, 9), np.nan)
+    stored[:, :n_old, :n_old] = pairwise_isc(data[:n_old])
+    ts_old = standardize_timeseries(data[:n_old])
+    m = ts_old.shape[1]
+    result = update_isc(stored[:, :m, :m], ts_old, standardize_timeseries(data[m:]))
+    np.testing.assert_allclose(result, pairwise_isc(data), atol=1e-12)
@@ -0,0 +1,23 @@
+import numpy as np
+
+from movie_variability.manifest import Manifest
+from movie_variability.store import MatrixStore
+
+
+def test_manifest_tracks_store_slice(tmp_path):
+    cube = tmp_path / 'cube.npy'
+    np.save(cube, np.arange(6.0))
+    store = MatrixStore.create(str(tmp_path / 'matrices'), {'movie': ['movie1', 'movie2']}, ['001', '002'])
+    manifest = Manifest(tmp_path / 'manifest.json')
+    manifest.record('movie1', {'cube': cube}, {'n': 1}, arrays={'matrices': store.get(movie='movie1')})
+    manifest.save()
+
+    manifest = Manifest(tmp_path / 'manifest.json')
+    assert manifest.is_current('movie1', {'cube': cube}, {'n': 1}, arrays={'matrices': store.get(movie='movie1')})
+    assert not manifest.is_current('movie1', {'cube': cube}, {'n': 2}, arrays={'matrices': store.get(movie='movie1')})
+    # writing another movie of the store leaves the unit current
+    store.set(np.ones((2, 2)), movie='movie2')
+    assert manifest.is_current('movie1', {'cube': cube}, {'n': 1}, arrays={'matrices': store.get(movie='movie1')})
+    # overwriting its own slice does not
+    store.set(np.ones((2, 2)), movie='movie1')
+    assert not manifest.is_current('movie1', {'cube': cube}, {'n': 1}, arrays={'matrices': store.get(movie='movie1')})
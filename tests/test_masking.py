@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+nib = pytest.importorskip('nibabel')
+
+from movie_variability.masking import group_mask
+
+
+def _write_masks(tmp_path, n_masks=5, shape=(8, 9, 7), seed=0):
+    rng = np.random.default_rng(seed)
+    base = np.zeros(shape, dtype=bool)
+    base[1:7, 2:8, 1:6] = True
+    paths = []
+    for i in range(n_masks):
+        mask = base & (rng.random(shape) > 0.15)
+        # an isolated voxel present in every mask, removed by the connected-component step
+        mask[0, 0, 0] = True
+        path = tmp_path / ('mask_%d.nii.gz' % i)
+        nib.Nifti1Image(mask.astype(np.int8), np.eye(4)).to_filename(str(path))
+        paths.append(path)
+    return paths
+
+
+@pytest.mark.parametrize('threshold', [0.0, 0.4, 0.8, 1.0])
+def test_group_mask_counts_more_than_threshold(tmp_path, threshold):
+    paths = _write_masks(tmp_path)
+    counts = sum(np.asarray(nib.load(str(path)).dataobj) for path in paths)
+    expected = counts > min(threshold, 1 - 1e-7) * len(paths)
+    result = np.asarray(group_mask(paths, threshold=threshold, connected=False).dataobj).astype(bool)
+    np.testing.assert_array_equal(result, expected)
+
+
+@pytest.mark.parametrize('threshold', [0.0, 0.4, 0.8, 1.0])
+@pytest.mark.parametrize('n_jobs', [1, 2])
+def test_group_mask_matches_intersect_masks(tmp_path, threshold, n_jobs):
+    masking = pytest.importorskip('nilearn.masking')
+    # 0.4 * 5 and 0.8 * 5 are integers: voxels in exactly that many masks are dropped
+    paths = _write_masks(tmp_path)
+    expected = masking.intersect_masks([str(path) for path in paths], threshold=threshold, connected=True)
+    result = group_mask(paths, threshold=threshold, n_jobs=n_jobs)
+    np.testing.assert_array_equal(np.asarray(result.dataobj).astype(bool), np.asarray(expected.dataobj).astype(bool))
+    np.testing.assert_allclose(result.affine, expected.affine)
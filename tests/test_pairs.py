@@ -0,0 +1,20 @@
+import numpy as np
+
+from movie_variability.pairs import PairIndex
+
+
+def test_from_real_pairs_adds_subjects_without_real_pair():
+    old = PairIndex.from_real_pairs(['001_002', '003_004'])
+    new = PairIndex.from_real_pairs(['001_002', '003_004'], subjects=['sub-001', '002', '003', '004', '005', 6])
+    assert new.subjects.tolist() == [1, 2, 3, 4, 5, 6]
+    assert len(new) == 15
+    rows, cols, real = new.pairs()
+    # real pairs are unchanged, the added subjects only have pseudo pairs
+    assert sorted(zip(new.subjects[rows[real]], new.subjects[cols[real]])) == [(1, 2), (3, 4)]
+    # the pairs of the old subjects keep their order
+    old_pairs = list(zip(old.subjects[old.upper_rows], old.subjects[old.upper_cols]))
+    new_pairs = [pair for pair in zip(new.subjects[rows], new.subjects[cols]) if max(pair) <= 4]
+    assert new_pairs == old_pairs
+    full_rows, full_cols, full_real = new.pairs(ordered=True)
+    assert len(full_rows) == 30 and full_real.sum() == 4
+    assert not np.isin(new.subjects[full_rows[full_real]], [5, 6]).any()
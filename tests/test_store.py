@@ -0,0 +1,31 @@
+import hashlib
+
+import numpy as np
+import pytest
+
+from movie_variability.store import array_checksum, load_timeseries_cube, save_timeseries_cube
+
+
+@pytest.mark.parametrize('shape', [(), (0, 3), (7,), (5, 4, 3)])
+@pytest.mark.parametrize('block_size', [1, 40, 1 << 24])
+def test_array_checksum_is_sha256_of_the_bytes(shape, block_size):
+    data = np.arange(int(np.prod(shape)), dtype=np.float32).reshape(shape)
+    assert array_checksum(data, block_size) == hashlib.sha256(data.tobytes()).hexdigest()
+    # non-contiguous views are hashed in C order
+    view = np.asfortranarray(data)
+    assert array_checksum(view, block_size) == hashlib.sha256(data.tobytes()).hexdigest()
+
+
+def test_load_timeseries_cube_verifies_checksum(tmp_path):
+    path = str(tmp_path / 'movie1_timeseries')
+    data = np.random.default_rng(0).standard_normal((3, 20, 4))
+    save_timeseries_cube(path, data, ['001', '002', '003'])
+    cube, subjects = load_timeseries_cube(path)
+    assert subjects == ['001', '002', '003']
+    np.testing.assert_array_equal(cube, data.astype(np.float32))
+    cube = np.load(path + '.npy', mmap_mode='r+')
+    cube[1, 5, 2] += 1
+    cube.flush()
+    del cube
+    with pytest.raises(ValueError):
+        load_timeseries_cube(path)
@@ -0,0 +1,26 @@
+import sys
+import subprocess
+
+from movie_variability import trace
+
+
+def test_span_records_peak_memory_of_child_processes(tmp_path, monkeypatch):
+    monkeypatch.setattr(trace, '_active', None)
+    tracer = trace.Tracer('test', trace_dir=str(tmp_path))
+    with trace.span('pool', movie='movie1') as span:
+        # a child process holding about 200 MB
+        subprocess.run([sys.executable, '-c', 'x = bytearray(200 * 1024**2); x[::4096] = b"1" * len(x[::4096])'],
+            check=True)
+        span.items = 1
+    record, = tracer.records
+    assert record['labels'] == {'movie': 'movie1'}
+    assert record['children_peak_rss_mb'] >= 200
+    row, = trace.summarize(trace.read_trace([tracer.path]))
+    assert row['children_peak_rss_mb'] == record['children_peak_rss_mb']
+
+
+def test_summarize_reads_traces_without_children_peak():
+    record = {'stage': 'isc', 'path': 'compute', 'start': 0, 'wall_s': 1.0, 'cpu_s': 1.0, 'peak_rss_mb': 10.0,
+        'read_bytes': None, 'written_bytes': None, 'items': 2}
+    row, = trace.summarize([record])
+    assert row['children_peak_rss_mb'] == 0.0 and row['peak_rss_mb'] == 10.0